@@ -18,7 +18,21 @@
 ##########################################################################
 
 from abc import ABC, abstractmethod
+from array import array
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from enum import Enum
+import csv
+import itertools
+import json
+import os
+import queue
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
 import typing
 
 # Create Base calss for Relationship
@@ -54,18 +68,182 @@ class Research:
 
 # The following classes follow the dependency inversion principle.
 class RelationshipBrowser(ABC):
+    def __init__(self):
+        # memoized transitive closures keyed by person name; browsers that do not call this,
+        # and so never invalidate them either, compute closures afresh on every call
+        self._descendants: typing.Dict[str, typing.FrozenSet[str]] = {}
+        self._ancestors: typing.Dict[str, typing.FrozenSet[str]] = {}
+
     @abstractmethod
     def find_all_children_of(self, name: str) -> typing.List[str]:
         pass
 
+    def find_all_parents_of(self, name: str) -> typing.Iterable[str]:
+        # storages that can walk up to the parents override this
+        raise NotImplementedError(f"{type(self).__name__} cannot find the parents of a person")
+
+    def find_all_children_of_many(self, names: typing.Iterable[str]) -> typing.Dict[str, typing.List[str]]:
+        # storages that have to scan their edges override this to answer every name in one pass
+        return {name: list(self.find_all_children_of(name)) for name in names}
+
+    def _find_relatives(self, name: str, relationship: Relationship) -> typing.Iterable[str]:
+        # Relationship.PARENT walks down to the children, Relationship.CHILD walks up to the parents
+        if relationship == Relationship.PARENT:
+            return self.find_all_children_of(name)
+        if relationship == Relationship.CHILD:
+            return self.find_all_parents_of(name)
+        raise ValueError(f"Cannot traverse along {relationship}")
+
+    def bfs(self, name: str, relationship: Relationship = Relationship.PARENT,
+            max_depth: typing.Optional[int] = None) -> typing.Iterator[typing.Tuple[str, int]]:
+        visited: typing.Set[str] = {name}
+        frontier: typing.List[str] = [name]
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            depth += 1
+            next_frontier: typing.List[str] = []
+            for current in frontier:
+                for relative in self._find_relatives(current, relationship):
+                    if relative not in visited:
+                        visited.add(relative)
+                        next_frontier.append(relative)
+                        yield relative, depth
+            frontier = next_frontier
+
+    def dfs(self, name: str, relationship: Relationship = Relationship.PARENT,
+            max_depth: typing.Optional[int] = None) -> typing.Iterator[typing.Tuple[str, int]]:
+        # a name reached again through a shorter path is yielded and expanded again, so nothing
+        # within max_depth is missed and dict(dfs(...)) maps every name to its shortest depth
+        depths: typing.Dict[str, int] = {name: 0}
+        stack: typing.List[typing.Tuple[str, int]] = [(name, 0)]
+        while stack:
+            current, depth = stack.pop()
+            if depth > depths[current]:
+                # a shorter path to current was pushed after this one
+                continue
+            if current != name:
+                yield current, depth
+            if max_depth is not None and depth >= max_depth:
+                continue
+            relatives = [relative for relative in self._find_relatives(current, relationship)
+                         if relative not in depths or depths[relative] > depth + 1]
+            depths.update((relative, depth + 1) for relative in relatives)
+            # push in reverse so that relatives are visited in their stored order
+            stack.extend((relative, depth + 1) for relative in reversed(relatives))
+
+    def _closure(self, cache: typing.Dict[str, typing.FrozenSet[str]], name: str,
+                 relationship: Relationship) -> typing.FrozenSet[str]:
+        closure = cache.get(name)
+        if closure is not None:
+            return closure
+
+        result: typing.Set[str] = set()
+        stack: typing.List[str] = [name]
+        while stack:
+            for relative in self._find_relatives(stack.pop(), relationship):
+                if relative in result:
+                    continue
+                result.add(relative)
+                # reuse the memoized closure of a relative instead of walking through it again
+                cached = cache.get(relative)
+                if cached is not None:
+                    result |= cached
+                else:
+                    stack.append(relative)
+
+        closure = cache[name] = frozenset(result)
+        return closure
+
+    def find_all_descendants_of(self, name: str) -> typing.FrozenSet[str]:
+        return self._closure(getattr(self, "_descendants", {}), name, Relationship.PARENT)
+
+    def find_all_ancestors_of(self, name: str) -> typing.FrozenSet[str]:
+        return self._closure(getattr(self, "_ancestors", {}), name, Relationship.CHILD)
+
+    def find_all_cousins_of(self, name: str) -> typing.Iterable[str]:
+        parents = set(self.find_all_parents_of(name))
+        aunts_and_uncles: typing.Dict[str, None] = {}
+        for parent in parents:
+            for grandparent in self.find_all_parents_of(parent):
+                for aunt_or_uncle in self.find_all_children_of(grandparent):
+                    if aunt_or_uncle not in parents:
+                        aunts_and_uncles[aunt_or_uncle] = None
+
+        cousins: typing.Set[str] = set()
+        for aunt_or_uncle in aunts_and_uncles:
+            for cousin in self.find_all_children_of(aunt_or_uncle):
+                if cousin not in cousins:
+                    cousins.add(cousin)
+                    yield cousin
+
+    def generation_distance(self, name: str, other: str) -> typing.Optional[int]:
+        # number of generations from name down to other through their nearest common ancestor,
+        # e.g. 1 for a child, -1 for a parent and 0 for a sibling or a cousin
+        depths = {name: 0}
+        depths.update(self.bfs(name, Relationship.CHILD))
+        other_depths = {other: 0}
+        other_depths.update(self.bfs(other, Relationship.CHILD))
+
+        common = depths.keys() & other_depths.keys()
+        if not common:
+            return None
+        nearest = min(common, key=lambda ancestor: depths[ancestor] + other_depths[ancestor])
+        return other_depths[nearest] - depths[nearest]
+
+    def _invalidate_closures(self, parent_name: str, child_name: str):
+        # a new edge parent -> child only changes the descendants of the parent and of every name
+        # whose cached descendants contain it, and likewise the ancestors of the child; the cached
+        # closures themselves say which entries those are, so the graph is never walked here
+        if getattr(self, "_descendants", None):
+            stale = [name for name, closure in self._descendants.items()
+                     if name == parent_name or parent_name in closure]
+            for name in stale:
+                del self._descendants[name]
+        if getattr(self, "_ancestors", None):
+            stale = [name for name, closure in self._ancestors.items()
+                     if name == child_name or child_name in closure]
+            for name in stale:
+                del self._ancestors[name]
+
 # This is a low-level module
 class Relationships(RelationshipBrowser):
     def __init__(self):
+        super().__init__()
         self.relations: typing.List[typing.Tuple[Person, Relationship, Person]] = []
+        # Person instances created by add_many, shared by every edge that mentions the same name
+        self.people: typing.Dict[str, Person] = {}
 
     def add_parent_and_child(self, parent: Person, child: Person):
         self.relations.append((parent, Relationship.PARENT, child))
         self.relations.append((child, Relationship.CHILD, parent))
+        self._invalidate_closures(parent.name, child.name)
+
+    def _person(self, name: str) -> Person:
+        person = self.people.get(name)
+        if person is None:
+            person = self.people[name] = Person(name)
+        return person
+
+    def add_many(self, rows: typing.Iterable[typing.Tuple[str, str]], batch_size: int = 10_000) -> int:
+        # rows are (parent name, child name) pairs; they are consumed lazily and
+        # appended batch by batch, so only one batch is ever buffered
+        count = 0
+        rows = iter(rows)
+        while True:
+            batch: typing.List[typing.Tuple[Person, Relationship, Person]] = []
+            for parent_name, child_name in itertools.islice(rows, batch_size):
+                parent = self._person(parent_name)
+                child = self._person(child_name)
+                batch.append((parent, Relationship.PARENT, child))
+                batch.append((child, Relationship.CHILD, parent))
+            if not batch:
+                return count
+
+            self.relations.extend(batch)
+            count += len(batch) // 2
+            # a whole batch touches too many closures to track one by one
+            self._descendants.clear()
+            self._ancestors.clear()
     
     def find_all_children_of(self, name: str) -> typing.Iterable[str]:
         relation: typing.Tuple[Person, Relationship, Person]
@@ -73,10 +251,344 @@ class Relationships(RelationshipBrowser):
             if relation[0].name == name and relation[1] == Relationship.PARENT:
                 yield relation[2].name
 
+    def find_all_parents_of(self, name: str) -> typing.Iterable[str]:
+        relation: typing.Tuple[Person, Relationship, Person]
+        for relation in self.relations:
+            if relation[0].name == name and relation[1] == Relationship.CHILD:
+                yield relation[2].name
+
+    def find_all_children_of_many(self, names: typing.Iterable[str]) -> typing.Dict[str, typing.List[str]]:
+        children: typing.Dict[str, typing.List[str]] = {name: [] for name in names}
+        relation: typing.Tuple[Person, Relationship, Person]
+        for relation in self.relations:
+            if relation[1] == Relationship.PARENT:
+                found = children.get(relation[0].name)
+                if found is not None:
+                    found.append(relation[2].name)
+        return children
+
+# This is another low-level module which keeps adjacency indexes keyed by
+# (person name, relationship), so every lookup only costs as much as its answer
+class IndexedRelationships(RelationshipBrowser):
+    def __init__(self):
+        super().__init__()
+        # dicts are used as insertion-ordered sets of names
+        self.index: typing.DefaultDict[typing.Tuple[str, Relationship], typing.Dict[str, None]] = defaultdict(dict)
+
+    def add_parent_and_child(self, parent: Person, child: Person):
+        children = self.index[(parent.name, Relationship.PARENT)]
+        if child.name in children:
+            return
+
+        for sibling in children:
+            self.index[(sibling, Relationship.SIBLING)][child.name] = None
+            self.index[(child.name, Relationship.SIBLING)][sibling] = None
+
+        children[child.name] = None
+        self.index[(child.name, Relationship.CHILD)][parent.name] = None
+        self._invalidate_closures(parent.name, child.name)
+
+    def _find(self, name: str, relationship: Relationship) -> typing.Iterable[str]:
+        # use get() so that a lookup never inserts an empty entry into the index
+        return iter(self.index.get((name, relationship), ()))
+
+    def find_all_children_of(self, name: str) -> typing.Iterable[str]:
+        return self._find(name, Relationship.PARENT)
+
+    def find_all_parents_of(self, name: str) -> typing.Iterable[str]:
+        return self._find(name, Relationship.CHILD)
+
+    def find_all_siblings_of(self, name: str) -> typing.Iterable[str]:
+        return self._find(name, Relationship.SIBLING)
+
+# This is a compact storage engine: person names are interned to integer IDs and
+# every edge is stored as one row of three typed columns instead of a tuple
+class CompactRelationships(RelationshipBrowser):
+    def __init__(self):
+        super().__init__()
+        self.ids: typing.Dict[str, int] = {}
+        self.names: typing.List[str] = []
+        self.sources = array("i")
+        self.relations = array("b")
+        self.targets = array("i")
+
+    def _intern(self, name: str) -> int:
+        person_id = self.ids.get(name)
+        if person_id is None:
+            person_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return person_id
+
+    def _append(self, source: int, relationship: Relationship, target: int):
+        self.sources.append(source)
+        self.relations.append(relationship.value)
+        self.targets.append(target)
+
+    def add_parent_and_child(self, parent: Person, child: Person):
+        parent_id = self._intern(parent.name)
+        child_id = self._intern(child.name)
+        self._append(parent_id, Relationship.PARENT, child_id)
+        self._append(child_id, Relationship.CHILD, parent_id)
+        self._invalidate_closures(parent.name, child.name)
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def _find(self, name: str, relationship: Relationship) -> typing.Iterable[str]:
+        person_id = self.ids.get(name)
+        if person_id is None:
+            return
+
+        code = relationship.value
+        for source, relation, target in zip(self.sources, self.relations, self.targets):
+            if source == person_id and relation == code:
+                yield self.names[target]
+
+    def find_all_children_of(self, name: str) -> typing.Iterable[str]:
+        return self._find(name, Relationship.PARENT)
+
+    def find_all_parents_of(self, name: str) -> typing.Iterable[str]:
+        return self._find(name, Relationship.CHILD)
+
+    def find_all_children_of_many(self, names: typing.Iterable[str]) -> typing.Dict[str, typing.List[str]]:
+        children: typing.Dict[str, typing.List[str]] = {name: [] for name in names}
+        # map the IDs we are looking for straight to their result lists
+        wanted = {self.ids[name]: found for name, found in children.items() if name in self.ids}
+        if not wanted:
+            return children
+
+        parent_code = Relationship.PARENT.value
+        for source, relation, target in zip(self.sources, self.relations, self.targets):
+            if relation == parent_code:
+                found = wanted.get(source)
+                if found is not None:
+                    found.append(self.names[target])
+        return children
+
+# A fixed-size pool of SQLite connections shared by the threads of one process
+class SqliteConnectionPool:
+    def __init__(self, filename: str, size: int = 4, timeout: float = 30.0):
+        self._connections: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=size)
+        for _ in range(size):
+            # a connection is only used by one thread at a time, but not always the same one
+            connection = sqlite3.connect(filename, timeout=timeout, check_same_thread=False)
+            # WAL lets readers run while another connection writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._connections.put(connection)
+
+    @contextmanager
+    def connection(self) -> typing.Iterator[sqlite3.Connection]:
+        connection = self._connections.get()
+        try:
+            yield connection
+        finally:
+            self._connections.put(connection)
+
+    def close(self):
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+# This is a persistent low-level module, the graph survives the process that built it.
+# Other processes may write to the same file, so closures are computed afresh on every call
+# instead of being memoized in this process.
+class SqliteRelationships(RelationshipBrowser):
+    # constant parameterized statements, so sqlite3 prepares each of them once per connection
+    _CREATE_TABLE = "CREATE TABLE IF NOT EXISTS relations (source TEXT NOT NULL, relation INTEGER NOT NULL, target TEXT NOT NULL)"
+    _CREATE_INDEX = "CREATE INDEX IF NOT EXISTS relations_source_relation ON relations (source, relation)"
+    _INSERT = "INSERT INTO relations (source, relation, target) VALUES (?, ?, ?)"
+    _SELECT = "SELECT target FROM relations WHERE source = ? AND relation = ?"
+    # stay below the default limit of 999 host parameters per statement
+    _MAX_BATCH = 900
+
+    def __init__(self, filename: str, pool_size: int = 4):
+        # every pooled connection would open its own private, empty database
+        if filename in ("", ":memory:"):
+            raise ValueError("SqliteRelationships needs a database file, not a private in-memory or temporary database")
+        super().__init__()
+        self.filename = filename
+        self.pool = SqliteConnectionPool(filename, pool_size)
+        with self.pool.connection() as connection, connection:
+            connection.execute(self._CREATE_TABLE)
+            connection.execute(self._CREATE_INDEX)
+
+    def add_parent_and_child(self, parent: Person, child: Person):
+        self.add_many([(parent.name, child.name)])
+
+    def add_many(self, rows: typing.Iterable[typing.Tuple[str, str]], batch_size: int = 10_000) -> int:
+        count = 0
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return count
+
+            # one transaction per batch
+            with self.pool.connection() as connection, connection:
+                connection.executemany(self._INSERT, self._edges(batch))
+            count += len(batch)
+
+    @staticmethod
+    def _edges(rows: typing.Iterable[typing.Tuple[str, str]]) -> typing.Iterator[typing.Tuple[str, int, str]]:
+        for parent_name, child_name in rows:
+            yield parent_name, Relationship.PARENT.value, child_name
+            yield child_name, Relationship.CHILD.value, parent_name
+
+    def _find(self, name: str, relationship: Relationship) -> typing.List[str]:
+        # fetch eagerly so that the connection goes back to the pool before the caller iterates
+        with self.pool.connection() as connection:
+            rows = connection.execute(self._SELECT, (name, relationship.value)).fetchall()
+        return [row[0] for row in rows]
+
+    def find_all_children_of(self, name: str) -> typing.List[str]:
+        return self._find(name, Relationship.PARENT)
+
+    def find_all_parents_of(self, name: str) -> typing.List[str]:
+        return self._find(name, Relationship.CHILD)
+
+    def find_all_descendants_of(self, name: str) -> typing.FrozenSet[str]:
+        return self._closure({}, name, Relationship.PARENT)
+
+    def find_all_ancestors_of(self, name: str) -> typing.FrozenSet[str]:
+        return self._closure({}, name, Relationship.CHILD)
+
+    def find_all_children_of_many(self, names: typing.Iterable[str]) -> typing.Dict[str, typing.List[str]]:
+        children: typing.Dict[str, typing.List[str]] = {name: [] for name in names}
+        unique_names = list(children)
+        with self.pool.connection() as connection:
+            for i in range(0, len(unique_names), self._MAX_BATCH):
+                chunk = unique_names[i:i + self._MAX_BATCH]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = connection.execute(
+                    f"SELECT source, target FROM relations WHERE relation = ? AND source IN ({placeholders})",
+                    (Relationship.PARENT.value, *chunk)).fetchall()
+                for source, target in rows:
+                    children[source].append(target)
+        return children
+
+    def close(self):
+        self.pool.close()
+
 class Research:
-    def __init__(self, browser: RelationshipBrowser):
-        for child in browser.find_all_children_of("Lucas"):
-            print(f"Lucas has a child called {child}")
+    def __init__(self, browser: RelationshipBrowser, names: typing.Optional[typing.Iterable[str]] = None):
+        if names is None:
+            for child in browser.find_all_children_of("Lucas"):
+                print(f"Lucas has a child called {child}")
+            return
+
+        # batch mode: ask the browser about every name at once
+        self.children = browser.find_all_children_of_many(names)
+        for name, children in self.children.items():
+            for child in children:
+                print(f"{name} has a child called {child}")
+
+def read_csv(filename: str) -> typing.Iterator[typing.Tuple[str, str]]:
+    # expects a header row with "parent" and "child" columns
+    with open(filename, newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            return
+        parent_index = header.index("parent")
+        child_index = header.index("child")
+        for row in reader:
+            if row:
+                yield row[parent_index], row[child_index]
+
+def read_jsonl(filename: str) -> typing.Iterator[typing.Tuple[str, str]]:
+    # expects one {"parent": ..., "child": ...} object per line
+    with open(filename) as file:
+        for line in file:
+            if line.strip():
+                row = json.loads(line)
+                yield row["parent"], row["child"]
+
+def bulk_load(relationships: Relationships, filename: str, batch_size: int = 10_000) -> int:
+    reader = read_jsonl if filename.endswith(".jsonl") else read_csv
+    start = time.perf_counter()
+    count = relationships.add_many(reader(filename), batch_size)
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    print(f"Loaded {count:,} rows from {os.path.basename(filename)} in {elapsed:.3f}s ({rate:,.0f} rows/s)")
+    return count
+
+def benchmark_memory(edge_counts: typing.Iterable[int] = (1_000_000, 10_000_000)):
+    # compare the list-of-tuples layout of Relationships with CompactRelationships;
+    # every add_parent_and_child call stores two edges
+    for edge_count in edge_counts:
+        pair_count = edge_count // 2
+        people_count = max(pair_count // 4, 2)
+        people = [Person(f"person{i}") for i in range(people_count)]
+        results: typing.Dict[str, int] = {}
+
+        # only the storage itself is traced, the Person objects are shared
+        for storage_type in (Relationships, CompactRelationships):
+            tracemalloc.start()
+            storage = storage_type()
+            for i in range(pair_count):
+                storage.add_parent_and_child(people[i % people_count], people[(i * 7 + 1) % people_count])
+            results[storage_type.__name__], _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del storage
+
+        print(f"{edge_count:,} edges:")
+        for name, size in results.items():
+            print(f"  {name:<22} {size / 2**20:10.1f} MiB {size / edge_count:8.1f} bytes/edge")
+
+def benchmark_sqlite(pair_count: int = 100_000, query_count: int = 200, threads: int = 4):
+    people_count = max(pair_count // 4, 2)
+    rows = [(f"person{i % people_count}", f"person{(i * 7 + 1) % people_count}") for i in range(pair_count)]
+    names = [f"person{random.randrange(people_count)}" for _ in range(query_count)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "relationships.db")
+        builder = SqliteRelationships(filename)
+        builder.add_many(rows)
+        builder.close()
+
+        # cold start: an in-memory graph has to be rebuilt, the SQLite file only has to be opened
+        start = time.perf_counter()
+        in_memory = Relationships()
+        in_memory.add_many(rows)
+        in_memory_start = time.perf_counter() - start
+
+        start = time.perf_counter()
+        persistent = SqliteRelationships(filename, threads)
+        sqlite_start = time.perf_counter() - start
+
+        print(f"{pair_count:,} pairs, {query_count:,} queries on {threads} threads:")
+        for browser, cold_start in ((in_memory, in_memory_start), (persistent, sqlite_start)):
+            with ThreadPoolExecutor(threads) as executor:
+                start = time.perf_counter()
+                for _ in executor.map(lambda name: list(browser.find_all_children_of(name)), names):
+                    pass
+                latency = (time.perf_counter() - start) / query_count
+            print(f"  {type(browser).__name__:<20} cold start {cold_start * 1e3:9.2f} ms, query {latency * 1e6:10.1f} us")
+        persistent.close()
+
+def benchmark_batch_queries(pair_count: int = 100_000, name_count: int = 1_000):
+    people_count = max(pair_count // 4, 2)
+    rows = [(f"person{i % people_count}", f"person{(i * 7 + 1) % people_count}") for i in range(pair_count)]
+    names = [f"person{i}" for i in random.sample(range(people_count), min(name_count, people_count))]
+
+    relationships = Relationships()
+    relationships.add_many(rows)
+    compact_relationships = CompactRelationships()
+    for parent_name, child_name in rows:
+        compact_relationships.add_parent_and_child(Person(parent_name), Person(child_name))
+
+    print(f"{pair_count:,} pairs, {len(names):,} names:")
+    for browser in (relationships, compact_relationships):
+        start = time.perf_counter()
+        one_by_one = {name: list(browser.find_all_children_of(name)) for name in names}
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched = browser.find_all_children_of_many(names)
+        batch_time = time.perf_counter() - start
+
+        assert batched == one_by_one
+        print(f"  {type(browser).__name__:<20} per-name loop {len(names) / loop_time:12,.0f} names/s, "
+              f"batch {len(names) / batch_time:12,.0f} names/s")
 
 if __name__ == "__main__":
     parent = Person("Lucas")
@@ -87,4 +599,73 @@ if __name__ == "__main__":
     relationships.add_parent_and_child(parent, child1)
     relationships.add_parent_and_child(parent, child2)
 
-    Research(relationships)
\ No newline at end of file
+    Research(relationships)
+
+    indexed_relationships = IndexedRelationships()
+    indexed_relationships.add_parent_and_child(parent, child1)
+    indexed_relationships.add_parent_and_child(parent, child2)
+
+    Research(indexed_relationships)
+    print(f"Emma's parents: {list(indexed_relationships.find_all_parents_of('Emma'))}")
+    print(f"Emma's siblings: {list(indexed_relationships.find_all_siblings_of('Emma'))}")
+
+    compact_relationships = CompactRelationships()
+    compact_relationships.add_parent_and_child(parent, child1)
+    compact_relationships.add_parent_and_child(parent, child2)
+
+    Research(compact_relationships)
+
+    grandparent = Person("Olivia")
+    uncle = Person("Noah")
+    cousin = Person("Mia")
+    for family in (relationships, indexed_relationships, compact_relationships):
+        family.add_parent_and_child(grandparent, parent)
+        family.add_parent_and_child(grandparent, uncle)
+        family.add_parent_and_child(uncle, cousin)
+
+    print(f"Olivia's descendants (BFS): {list(indexed_relationships.bfs('Olivia'))}")
+    print(f"Olivia's descendants (DFS): {list(indexed_relationships.dfs('Olivia'))}")
+    print(f"Olivia's children only: {list(indexed_relationships.bfs('Olivia', max_depth=1))}")
+    print(f"Emma's ancestors: {sorted(relationships.find_all_ancestors_of('Emma'))}")
+    print(f"Emma's cousins: {list(compact_relationships.find_all_cousins_of('Emma'))}")
+    print(f"Generations from Noah to Emma: {relationships.generation_distance('Noah', 'Emma')}")
+
+    # the memoized closures are invalidated when a new edge reaches them
+    relationships.add_parent_and_child(child1, Person("Liam"))
+    print(f"Olivia's descendants after Liam was born: {sorted(relationships.find_all_descendants_of('Olivia'))}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_filename = os.path.join(directory, "family.csv")
+        with open(csv_filename, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["parent", "child"])
+            writer.writerows([("Lucas", "Emma"), ("Lucas", "Copper")])
+
+        jsonl_filename = os.path.join(directory, "family.jsonl")
+        with open(jsonl_filename, "w") as file:
+            for parent_name, child_name in [("Olivia", "Lucas"), ("Olivia", "Noah"), ("Noah", "Mia")]:
+                file.write(json.dumps({"parent": parent_name, "child": child_name}) + "\n")
+
+        loaded_relationships = Relationships()
+        bulk_load(loaded_relationships, csv_filename)
+        bulk_load(loaded_relationships, jsonl_filename)
+        Research(loaded_relationships)
+        print(f"Olivia's descendants: {sorted(loaded_relationships.find_all_descendants_of('Olivia'))}")
+        Research(loaded_relationships, ["Lucas", "Olivia", "Noah"])
+
+        sqlite_filename = os.path.join(directory, "family.db")
+        sqlite_relationships = SqliteRelationships(sqlite_filename)
+        sqlite_relationships.add_parent_and_child(parent, child1)
+        sqlite_relationships.add_parent_and_child(parent, child2)
+        sqlite_relationships.close()
+
+        # another worker opens the same file without rebuilding the graph
+        sqlite_relationships = SqliteRelationships(sqlite_filename)
+        with ThreadPoolExecutor(2) as executor:
+            for name, children in zip(["Lucas", "Emma"], executor.map(sqlite_relationships.find_all_children_of, ["Lucas", "Emma"])):
+                print(f"{name}'s children from SQLite: {children}")
+        sqlite_relationships.close()
+
+    #benchmark_memory()
+    #benchmark_sqlite()
+    #benchmark_batch_queries()
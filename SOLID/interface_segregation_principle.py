@@ -18,6 +18,12 @@
 ##########################################################################
 
 from abc import (ABC, abstractmethod)
+from concurrent.futures import Executor, ThreadPoolExecutor
+import asyncio
+import queue
+import threading
+import time
+import typing
 
 # The following classes violates the interface segregation principle.
 class Machine(ABC):
@@ -95,6 +101,274 @@ class MultiFunctionMachine(MultiFunctionDevice):
     def scan_document(self, document: str):
         self.scanner.scan_document(document)
 
+# DeviceWorker feeds one device from a bounded queue on its own thread.
+# Submitting to a full queue blocks, so a slow device pushes back on whoever feeds it.
+# A document that fails is counted and its exception kept in last_error; the worker carries on.
+class DeviceWorker:
+    def __init__(self, name: str, handler: typing.Callable[[str], None], queue_size: int = 8):
+        self.name = name
+        self.handler = handler
+        # (document, callback run after the device is done with it), None stops the worker
+        self.queue: "queue.Queue[typing.Optional[typing.Tuple[str, typing.Optional[typing.Callable[[str], None]]]]]" = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.busy_time = 0.0
+        self.max_queue_depth = 0
+        self.errors = 0
+        self.last_error: typing.Optional[Exception] = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, document: str, then: typing.Optional[typing.Callable[[str], None]] = None):
+        self.queue.put((document, then))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                document, then = job
+                start = time.perf_counter()
+                self.handler(document)
+                self.busy_time += time.perf_counter() - start
+                self.processed += 1
+                if then is not None:
+                    then(document)
+            except Exception as error:
+                # a dead worker would leave the queue full and every join() waiting forever
+                self.errors += 1
+                self.last_error = error
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        self.queue.join()
+
+    def stop(self):
+        self.queue.put(None)
+        self._thread.join()
+
+    def stats(self) -> typing.Dict[str, float]:
+        return {
+            "processed": self.processed,
+            "throughput": self.processed / self.busy_time if self.busy_time else 0.0,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "errors": self.errors,
+        }
+
+# PipelinedMultiFunctionMachine gives the printer and the scanner a worker each, so a slow scan
+# no longer blocks printing. print_document and scan_document only queue the document.
+class PipelinedMultiFunctionMachine(MultiFunctionDevice):
+    def __init__(self, printer: Printer, scanner: Scanner, queue_size: int = 8):
+        self.printer = printer
+        self.scanner = scanner
+        self.print_worker = DeviceWorker("printer", printer.print_document, queue_size)
+        self.scan_worker = DeviceWorker("scanner", scanner.scan_document, queue_size)
+
+    def print_document(self, document: str):
+        self.print_worker.submit(document)
+
+    def scan_document(self, document: str):
+        self.scan_worker.submit(document)
+
+    def print_documents(self, documents: typing.Iterable[str]):
+        for document in documents:
+            self.print_document(document)
+
+    def scan_documents(self, documents: typing.Iterable[str]):
+        for document in documents:
+            self.scan_document(document)
+
+    def copy_documents(self, documents: typing.Iterable[str]):
+        # scan -> print chaining: the scanner thread queues every scanned document for the printer.
+        # When the printer queue is full the scanner waits, its own queue fills up and then the caller waits.
+        for document in documents:
+            self.scan_worker.submit(document, then=self.print_worker.submit)
+
+    def wait(self):
+        # the scanner goes first because it may still feed the printer
+        self.scan_worker.join()
+        self.print_worker.join()
+
+    def close(self):
+        self.wait()
+        self.scan_worker.stop()
+        self.print_worker.stop()
+
+    def stats(self) -> typing.Dict[str, typing.Dict[str, float]]:
+        return {worker.name: worker.stats() for worker in (self.print_worker, self.scan_worker)}
+
+# Simulated devices that take some time for every document but print nothing
+class SimulatedPrinter(Printer):
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def print_document(self, document: str):
+        time.sleep(self.latency)
+
+class SimulatedScanner(Scanner):
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def scan_document(self, document: str):
+        time.sleep(self.latency)
+
+# Async counterparts of the interfaces, for devices driven from one event loop
+class AsyncPrinter(ABC):
+    @abstractmethod
+    async def print_document(self, document: str):
+        pass
+
+class AsyncScanner(ABC):
+    @abstractmethod
+    async def scan_document(self, document: str):
+        pass
+
+class AsyncMultiFunctionDevice(AsyncPrinter, AsyncScanner):
+    pass
+
+# Adapters run the blocking devices in an executor (the default thread pool when none is given)
+class AsyncPrinterAdapter(AsyncPrinter):
+    def __init__(self, printer: Printer, executor: typing.Optional[Executor] = None):
+        self.printer = printer
+        self.executor = executor
+
+    async def print_document(self, document: str):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.printer.print_document, document)
+
+class AsyncScannerAdapter(AsyncScanner):
+    def __init__(self, scanner: Scanner, executor: typing.Optional[Executor] = None):
+        self.scanner = scanner
+        self.executor = executor
+
+    async def scan_document(self, document: str):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.scanner.scan_document, document)
+
+class AsyncMultiFunctionAdapter(AsyncPrinterAdapter, AsyncScannerAdapter, AsyncMultiFunctionDevice):
+    def __init__(self, device: typing.Union[MultiFunctionDevice, Photocopier], executor: typing.Optional[Executor] = None):
+        AsyncPrinterAdapter.__init__(self, device, executor)
+        AsyncScannerAdapter.__init__(self, device, executor)
+
+# AsyncDevicePool spreads documents over interchangeable devices. Each device runs at most
+# max_concurrency documents at a time; a document waits in the pool until a capable device has
+# a free slot and then goes to the least loaded one, so faster devices take more documents.
+# Cancelling a caller, waiting or running, frees its place.
+class AsyncDevicePool(AsyncMultiFunctionDevice):
+    def __init__(self, devices: typing.Iterable[typing.Union[AsyncPrinter, AsyncScanner]], max_concurrency: int = 1):
+        self.devices = list(devices)
+        self.max_concurrency = max_concurrency
+        self.loads: typing.List[int] = [0] * len(self.devices)
+        self.completed: typing.List[int] = [0] * len(self.devices)
+        self.waiting = 0
+        # one condition per kind of document, all on one lock: a freed slot wakes a single
+        # waiter of each kind the device handles instead of every waiter in the pool
+        self._lock = asyncio.Lock()
+        self._slot_freed: typing.Dict[type, asyncio.Condition] = {
+            kind: asyncio.Condition(self._lock) for kind in (AsyncPrinter, AsyncScanner)}
+
+    async def _dispatch(self, kind: type, operation: typing.Callable[[typing.Any], typing.Awaitable[None]]):
+        candidates = [i for i, device in enumerate(self.devices) if isinstance(device, kind)]
+        if not candidates:
+            raise LookupError(f"No device in the pool is an {kind.__name__}")
+
+        slot_freed = self._slot_freed[kind]
+        async with self._lock:
+            self.waiting += 1
+            try:
+                await slot_freed.wait_for(lambda: any(self.loads[i] < self.max_concurrency for i in candidates))
+            except asyncio.CancelledError:
+                # the wake-up this waiter may have received passes to the next one
+                slot_freed.notify()
+                raise
+            finally:
+                self.waiting -= 1
+            index = min((i for i in candidates if self.loads[i] < self.max_concurrency), key=lambda i: self.loads[i])
+            self.loads[index] += 1
+
+        try:
+            await operation(self.devices[index])
+            self.completed[index] += 1
+        finally:
+            async with self._lock:
+                self.loads[index] -= 1
+                for device_kind, condition in self._slot_freed.items():
+                    if isinstance(self.devices[index], device_kind):
+                        condition.notify()
+
+    async def print_document(self, document: str):
+        await self._dispatch(AsyncPrinter, lambda device: device.print_document(document))
+
+    async def scan_document(self, document: str):
+        await self._dispatch(AsyncScanner, lambda device: device.scan_document(document))
+
+    async def print_documents(self, documents: typing.Iterable[str]):
+        await asyncio.gather(*(self.print_document(document) for document in documents))
+
+    async def scan_documents(self, documents: typing.Iterable[str]):
+        await asyncio.gather(*(self.scan_document(document) for document in documents))
+
+# A fake networked device that only waits, for trying the pool without hardware
+class FakeAsyncDevice(AsyncMultiFunctionDevice):
+    def __init__(self, name: str, latency: float):
+        self.name = name
+        self.latency = latency
+        self.documents: typing.List[str] = []
+
+    async def print_document(self, document: str):
+        await asyncio.sleep(self.latency)
+        self.documents.append(document)
+
+    async def scan_document(self, document: str):
+        await asyncio.sleep(self.latency)
+        self.documents.append(document)
+
+async def use_async_device_pool():
+    fast = FakeAsyncDevice("fast", 0.01)
+    slow = FakeAsyncDevice("slow", 0.03)
+    pool = AsyncDevicePool([fast, slow], max_concurrency=2)
+    await pool.print_documents(f"Page {i}" for i in range(12))
+    print(f"Fast device printed {len(fast.documents)} pages, slow device printed {len(slow.documents)} pages")
+
+    # a cancelled document gives its slot back
+    task = asyncio.ensure_future(pool.scan_document("Cancelled page"))
+    await asyncio.sleep(0)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    print(f"Documents in flight after cancelling: {pool.loads}, waiting: {pool.waiting}")
+
+    # these devices print to the console, so one shared thread keeps their lines apart
+    with ThreadPoolExecutor(1) as executor:
+        adapters = AsyncDevicePool([AsyncPrinterAdapter(MyPrinter(), executor), AsyncMultiFunctionAdapter(Photocopier(), executor)])
+        await adapters.print_documents(["Hello", "World"])
+        await adapters.scan_document("Hello")
+
+def benchmark_pipelined_machine(documents: int = 50, print_latency: float = 0.01, scan_latency: float = 0.02):
+    names = [f"document {i}" for i in range(documents)]
+    printer = SimulatedPrinter(print_latency)
+    scanner = SimulatedScanner(scan_latency)
+
+    start = time.perf_counter()
+    machine = MultiFunctionMachine(printer, scanner)
+    for name in names:
+        machine.scan_document(name)
+        machine.print_document(name)
+    sequential_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pipelined_machine = PipelinedMultiFunctionMachine(printer, scanner)
+    pipelined_machine.copy_documents(names)
+    pipelined_machine.close()
+    pipelined_time = time.perf_counter() - start
+
+    print(f"{documents} documents scanned then printed:")
+    print(f"  MultiFunctionMachine          {sequential_time:7.3f}s")
+    print(f"  PipelinedMultiFunctionMachine {pipelined_time:7.3f}s ({sequential_time / pipelined_time:.1f}x)")
+    for name, stats in pipelined_machine.stats().items():
+        print(f"    {name:<8} {stats['processed']:4} documents, {stats['throughput']:8.1f} documents/s, "
+              f"max queue depth {stats['max_queue_depth']}")
+
 if __name__ == "__main__":
     old_fashion_printer = OldFashionedPrinter()
     old_fashion_printer.print_document("Hello")
@@ -105,4 +379,14 @@ if __name__ == "__main__":
     my_scanner = MyScanner()
     multi_function_machine = MultiFunctionMachine(my_printer, my_scanner)
     multi_function_machine.print_document("Hello")
-    multi_function_machine.scan_document("Hello")
\ No newline at end of file
+    multi_function_machine.scan_document("Hello")
+
+    # the workers run on two threads, so the devices stay quiet and the main thread reports
+    pipelined_machine = PipelinedMultiFunctionMachine(SimulatedPrinter(0.01), SimulatedScanner(0.02))
+    pipelined_machine.copy_documents(["Page 1", "Page 2"])
+    pipelined_machine.close()
+    print(f"Pipelined machine statistics: {pipelined_machine.stats()}")
+
+    asyncio.run(use_async_device_pool())
+
+    #benchmark_pipelined_machine()
@@ -17,6 +17,16 @@
 # Author: Wei-Chih Lin (weichih.lin@protonmail.com)
 ##########################################################################
 
+import random
+import time
+import typing
+
+# NumPy is only needed by RectangleArray
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 class Rectangle:
     def __init__(self, width: float, height: float):
         self._width = width
@@ -57,6 +67,108 @@ class Square(Rectangle):
     def height(self, value: float):
         self._width = self._height = value
 
+# RectangleArray stores many rectangles as NumPy width and height columns. Rows flagged as squares
+# keep width and height locked together through the bulk setters, just like the Square setters.
+class RectangleArray:
+    def __init__(self, widths: typing.Iterable[float], heights: typing.Iterable[float],
+                 is_square: typing.Optional[typing.Iterable[bool]] = None):
+        if np is None:
+            raise ImportError("RectangleArray requires NumPy")
+
+        self._widths = np.array(widths, dtype=np.float64)
+        self._heights = np.array(heights, dtype=np.float64)
+        if self._widths.shape != self._heights.shape or self._widths.ndim != 1:
+            raise ValueError("widths and heights must be one-dimensional and of the same length")
+        if is_square is None:
+            self._is_square = np.zeros(len(self._widths), dtype=bool)
+        else:
+            self._is_square = np.array(is_square, dtype=bool)
+            if self._is_square.shape != self._widths.shape:
+                raise ValueError("is_square must be of the same length as widths and heights")
+        # a square starts out with its width as both sides, like Square(size)
+        self._heights[self._is_square] = self._widths[self._is_square]
+
+    @classmethod
+    def from_shapes(cls, shapes: typing.Sequence[Rectangle]) -> "RectangleArray":
+        return cls([shape.width for shape in shapes], [shape.height for shape in shapes],
+                   [isinstance(shape, Square) for shape in shapes])
+
+    def __len__(self) -> int:
+        return len(self._widths)
+
+    def __getitem__(self, index: int) -> Rectangle:
+        if self._is_square[index]:
+            return Square(float(self._widths[index]))
+        return Rectangle(float(self._widths[index]), float(self._heights[index]))
+
+    # the columns are handed out read-only, so the square constraint cannot be bypassed
+    @staticmethod
+    def _read_only(column: "np.ndarray") -> "np.ndarray":
+        view = column.view()
+        view.flags.writeable = False
+        return view
+
+    @property
+    def widths(self) -> "np.ndarray":
+        return self._read_only(self._widths)
+
+    @property
+    def heights(self) -> "np.ndarray":
+        return self._read_only(self._heights)
+
+    @property
+    def is_square(self) -> "np.ndarray":
+        return self._read_only(self._is_square)
+
+    @property
+    def area(self) -> "np.ndarray":
+        return self._widths * self._heights
+
+    # rows may be None (every row), an index, a slice, an index array or a boolean mask;
+    # values are assigned the way NumPy assigns them, then the squares among the rows
+    # written take the new side on both columns
+    def _squares(self, rows) -> "np.ndarray":
+        written = np.atleast_1d(np.arange(len(self))[rows])
+        return written[self._is_square[written]]
+
+    def set_widths(self, values, rows=None):
+        rows = slice(None) if rows is None else rows
+        self._widths[rows] = values
+        squares = self._squares(rows)
+        self._heights[squares] = self._widths[squares]
+
+    def set_heights(self, values, rows=None):
+        rows = slice(None) if rows is None else rows
+        self._heights[rows] = values
+        squares = self._squares(rows)
+        self._widths[squares] = self._heights[squares]
+
+def benchmark_rectangle_array(count: int = 1_000_000):
+    shapes = [Square(random.uniform(1, 10)) if random.random() < 0.2 else
+              Rectangle(random.uniform(1, 10), random.uniform(1, 10)) for _ in range(count)]
+    rectangles = RectangleArray.from_shapes(shapes)
+
+    start = time.perf_counter()
+    areas = [shape.area for shape in shapes]
+    objects_area_time = time.perf_counter() - start
+    start = time.perf_counter()
+    array_areas = rectangles.area
+    array_area_time = time.perf_counter() - start
+    assert np.allclose(areas, array_areas)
+
+    start = time.perf_counter()
+    for shape in shapes:
+        shape.height = 10
+    objects_set_time = time.perf_counter() - start
+    start = time.perf_counter()
+    rectangles.set_heights(10)
+    array_set_time = time.perf_counter() - start
+    assert np.allclose([shape.width for shape in shapes], rectangles.widths)
+
+    print(f"{count:,} rectangles:")
+    print(f"  area        list of objects {objects_area_time * 1e3:9.2f} ms, RectangleArray {array_area_time * 1e3:9.2f} ms")
+    print(f"  set height  list of objects {objects_set_time * 1e3:9.2f} ms, RectangleArray {array_set_time * 1e3:9.2f} ms")
+
 def use_it(rectangle: Rectangle):
     width = rectangle.width
     rectangle.height = 10 # This will change the width of the rectangle. It will cause unpleasant side effect
@@ -69,4 +181,11 @@ if __name__ == "__main__":
     use_it(rectangle)
 
     square = Square(5)
-    use_it(square)
\ No newline at end of file
+    use_it(square)
+
+    if np is not None:
+        rectangles = RectangleArray.from_shapes([Rectangle(2, 3), Square(5)])
+        rectangles.set_heights(10)
+        print(f"Areas after setting every height to 10: {rectangles.area}")
+
+    #benchmark_rectangle_array()
@@ -17,8 +17,21 @@
 # Author: Wei-Chih Lin (weichih.lin@protonmail.com)
 ##########################################################################
 
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from enum import Enum
+import itertools
+import os
+import random
+import time
 import typing
+import weakref
+
+# NumPy is only needed by ProductTable
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class Color(Enum):
     RED = 1
@@ -71,6 +84,92 @@ class Specification:
     def is_satisfied(self, item: Product) -> bool:
         raise NotImplementedError
 
+    # specifications compare and hash by structure, so equivalent trees built separately are
+    # interchangeable as dictionary keys; subclasses without a _key keep identity semantics
+    def _key(self) -> typing.Hashable:
+        return id(self)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Specification):
+            return NotImplemented
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash((type(self), self._key()))
+
+    @staticmethod
+    def _constant(constants: typing.List[typing.Any], value: typing.Any) -> str:
+        constants.append(value)
+        return f"_c{len(constants) - 1}"
+
+    def _expression(self, constants: typing.List[typing.Any], depth: int = 0) -> str:
+        # a specification that cannot be inlined is called through its own is_satisfied
+        return f"{self._constant(constants, self.is_satisfied)}(item)"
+
+    # the parser rejects deeply nested parentheses, so past this many nested combinators
+    # a subtree is compiled into a predicate of its own and called from the outer expression
+    _MAX_NESTING = 50
+
+    def _child_expression(self, constants: typing.List[typing.Any], depth: int) -> str:
+        if depth >= self._MAX_NESTING:
+            return f"{self._constant(constants, self._predicate())}(item)"
+        return self._expression(constants, depth)
+
+    def _predicate(self) -> typing.Callable[[Product], bool]:
+        constants: typing.List[typing.Any] = []
+        expression = self._expression(constants)
+        namespace = {f"_c{i}": constant for i, constant in enumerate(constants)}
+        return eval(f"lambda item: {expression}", namespace)
+
+    # compile the whole specification tree into one predicate, so that evaluating an item
+    # costs a single function call instead of one method call (and lambda) per tree node.
+    # The predicate is kept with the _key it was compiled for and compiled again when a
+    # change to the specification or to any of its children changes that key
+    def compile(self) -> typing.Callable[[Product], bool]:
+        key = self._key()
+        compiled = self.__dict__.get("_compiled")
+        if compiled is None or compiled[0] != key:
+            compiled = self._compiled = (key, self._predicate())
+        return compiled[1]
+
+    # the compiled predicate cannot be pickled, a worker process compiles its own
+    def __getstate__(self) -> typing.Dict[str, typing.Any]:
+        state = self.__dict__.copy()
+        state.pop("_compiled", None)
+        return state
+
+    # a subclass that overrides is_satisfied can mean anything, so the fast paths that cls
+    # derives from its own is_satisfied (inlining, indexes, masks...) do not apply to it
+    def _overrides(self, cls: type) -> bool:
+        return type(self).is_satisfied is not cls.is_satisfied
+
+    # ask the catalog indexes for the matching product ids; returns None when no index
+    # can serve this specification, otherwise the candidate ids and whether they are exact
+    def _lookup(self, catalog: "ProductCatalog") -> typing.Optional[typing.Tuple[typing.Set[int], bool]]:
+        return None
+
+    # evaluate the specification on a whole ProductTable at once, one boolean per row
+    def _mask(self, table: "ProductTable") -> "np.ndarray":
+        # row by row fallback for specifications without a vectorized form
+        return np.fromiter((self.is_satisfied(table.product(i)) for i in range(len(table))), dtype=bool, count=len(table))
+
+    # the product attributes the specification reads, or None when that is unknown
+    def _attributes(self) -> typing.Optional[typing.FrozenSet[str]]:
+        return None
+
+    # (attribute, value) pairs of which a product must have at least one to be satisfied,
+    # or None when that is unknown; catalogs use them to find the views a new product can enter
+    def _requirements(self) -> typing.Optional[typing.FrozenSet[typing.Tuple[str, typing.Any]]]:
+        return None
+
+    # combinators reorder their children with the statistics, leaves are returned as they are
+    def reordered(self, statistics: "CatalogStatistics") -> "Specification":
+        return self
+
+    # wrap every leaf so that the counter sees each predicate evaluation
+    def instrumented(self, counter: "EvaluationCounter") -> "Specification":
+        return CountingSpecification(self, counter)
+
 # ColorSpecification and SizeSpecification are concrete classes that inherit from Specification
 class ColorSpecification(Specification):
     def __init__(self, color: Color):
@@ -79,6 +178,34 @@ class ColorSpecification(Specification):
     def is_satisfied(self, item: Product) -> bool:
         return item.color == self.color
 
+    def _key(self) -> typing.Hashable:
+        return self.color
+
+    def _expression(self, constants: typing.List[typing.Any], depth: int = 0) -> str:
+        if self._overrides(ColorSpecification):
+            return super()._expression(constants, depth)
+        return f"item.color == {self._constant(constants, self.color)}"
+
+    def _lookup(self, catalog: "ProductCatalog") -> typing.Optional[typing.Tuple[typing.Set[int], bool]]:
+        if self._overrides(ColorSpecification):
+            return super()._lookup(catalog)
+        return catalog.by_color.get(self.color, set()), True
+
+    def _mask(self, table: "ProductTable") -> "np.ndarray":
+        if self._overrides(ColorSpecification):
+            return super()._mask(table)
+        return table.colors == table.COLOR_CODES[self.color]
+
+    def _attributes(self) -> typing.Optional[typing.FrozenSet[str]]:
+        if self._overrides(ColorSpecification):
+            return super()._attributes()
+        return frozenset({"color"})
+
+    def _requirements(self) -> typing.Optional[typing.FrozenSet[typing.Tuple[str, typing.Any]]]:
+        if self._overrides(ColorSpecification):
+            return super()._requirements()
+        return frozenset({("color", self.color)})
+
 class SizeSpecification(Specification):
     def __init__(self, size: Size):
         self.size = size
@@ -86,6 +213,34 @@ class SizeSpecification(Specification):
     def is_satisfied(self, item: Product) -> bool:
         return item.size == self.size
 
+    def _key(self) -> typing.Hashable:
+        return self.size
+
+    def _expression(self, constants: typing.List[typing.Any], depth: int = 0) -> str:
+        if self._overrides(SizeSpecification):
+            return super()._expression(constants, depth)
+        return f"item.size == {self._constant(constants, self.size)}"
+
+    def _lookup(self, catalog: "ProductCatalog") -> typing.Optional[typing.Tuple[typing.Set[int], bool]]:
+        if self._overrides(SizeSpecification):
+            return super()._lookup(catalog)
+        return catalog.by_size.get(self.size, set()), True
+
+    def _mask(self, table: "ProductTable") -> "np.ndarray":
+        if self._overrides(SizeSpecification):
+            return super()._mask(table)
+        return table.sizes == table.SIZE_CODES[self.size]
+
+    def _attributes(self) -> typing.Optional[typing.FrozenSet[str]]:
+        if self._overrides(SizeSpecification):
+            return super()._attributes()
+        return frozenset({"size"})
+
+    def _requirements(self) -> typing.Optional[typing.FrozenSet[typing.Tuple[str, typing.Any]]]:
+        if self._overrides(SizeSpecification):
+            return super()._requirements()
+        return frozenset({("size", self.size)})
+
 # AndSpecification is a concrete class that inherits from Specification
 class AndSpecification(Specification):
     def __init__(self, *args: Specification):
@@ -94,6 +249,200 @@ class AndSpecification(Specification):
     def is_satisfied(self, item: Product) -> bool:
         return all(map(lambda spec: spec.is_satisfied(item), self.args))
 
+    def _key(self) -> typing.Hashable:
+        # the order of the children does not change the result
+        return frozenset(self.args)
+
+    def _expression(self, constants: typing.List[typing.Any], depth: int = 0) -> str:
+        if self._overrides(AndSpecification):
+            return super()._expression(constants, depth)
+        # nested AndSpecifications flatten into one chain of "and"
+        if not self.args:
+            return "True"
+        # a loop rather than a generator, which would add a stack frame per level of nesting
+        expressions = []
+        for spec in self.args:
+            expressions.append(spec._child_expression(constants, depth + 1))
+        return "(" + " and ".join(expressions) + ")"
+
+    def _lookup(self, catalog: "ProductCatalog") -> typing.Optional[typing.Tuple[typing.Set[int], bool]]:
+        if self._overrides(AndSpecification):
+            return super()._lookup(catalog)
+        found = [spec._lookup(catalog) for spec in self.args]
+        indexed = [result for result in found if result is not None]
+        if not indexed:
+            return None
+
+        # intersect starting from the smallest id set
+        id_sets = sorted((ids for ids, _ in indexed), key=len)
+        ids = id_sets[0].intersection(*id_sets[1:])
+        # children without an index still have to be checked on the candidates
+        exact = len(indexed) == len(found) and all(exact for _, exact in indexed)
+        return ids, exact
+
+    def _mask(self, table: "ProductTable") -> "np.ndarray":
+        if self._overrides(AndSpecification):
+            return super()._mask(table)
+        mask = np.ones(len(table), dtype=bool)
+        for spec in self.args:
+            mask &= spec._mask(table)
+        return mask
+
+    def _attributes(self) -> typing.Optional[typing.FrozenSet[str]]:
+        if self._overrides(AndSpecification):
+            return super()._attributes()
+        attributes = [spec._attributes() for spec in self.args]
+        if any(found is None for found in attributes):
+            return None
+        return frozenset().union(*attributes)
+
+    def _requirements(self) -> typing.Optional[typing.FrozenSet[typing.Tuple[str, typing.Any]]]:
+        if self._overrides(AndSpecification):
+            return super()._requirements()
+        # every child must hold, so the narrowest known requirements of any child will do
+        known = [found for found in (spec._requirements() for spec in self.args) if found is not None]
+        return min(known, key=len) if known else None
+
+    def reordered(self, statistics: "CatalogStatistics") -> Specification:
+        if self._overrides(AndSpecification):
+            return super().reordered(statistics)
+        # run the children that are cheap and likely to fail first
+        args = [spec.reordered(statistics) for spec in self.args]
+        return AndSpecification(*sorted(args, key=lambda spec: statistics.cost(spec) / max(1 - statistics.selectivity(spec), 1e-9)))
+
+    def instrumented(self, counter: "EvaluationCounter") -> Specification:
+        if self._overrides(AndSpecification):
+            return super().instrumented(counter)
+        return AndSpecification(*(spec.instrumented(counter) for spec in self.args))
+
+class OrSpecification(Specification):
+    def __init__(self, *args: Specification):
+        self.args = args
+
+    def is_satisfied(self, item: Product) -> bool:
+        # stops at the first satisfied child
+        for spec in self.args:
+            if spec.is_satisfied(item):
+                return True
+        return False
+
+    def _key(self) -> typing.Hashable:
+        return frozenset(self.args)
+
+    def _expression(self, constants: typing.List[typing.Any], depth: int = 0) -> str:
+        if self._overrides(OrSpecification):
+            return super()._expression(constants, depth)
+        if not self.args:
+            return "False"
+        expressions = []
+        for spec in self.args:
+            expressions.append(spec._child_expression(constants, depth + 1))
+        return "(" + " or ".join(expressions) + ")"
+
+    def _lookup(self, catalog: "ProductCatalog") -> typing.Optional[typing.Tuple[typing.Set[int], bool]]:
+        if self._overrides(OrSpecification):
+            return super()._lookup(catalog)
+        # a single child without an index can match any product
+        found = [spec._lookup(catalog) for spec in self.args]
+        if not found or any(result is None for result in found):
+            return None
+        return set().union(*(ids for ids, _ in found)), all(exact for _, exact in found)
+
+    def _mask(self, table: "ProductTable") -> "np.ndarray":
+        if self._overrides(OrSpecification):
+            return super()._mask(table)
+        mask = np.zeros(len(table), dtype=bool)
+        for spec in self.args:
+            mask |= spec._mask(table)
+        return mask
+
+    def _attributes(self) -> typing.Optional[typing.FrozenSet[str]]:
+        if self._overrides(OrSpecification):
+            return super()._attributes()
+        attributes = [spec._attributes() for spec in self.args]
+        if any(found is None for found in attributes):
+            return None
+        return frozenset().union(*attributes)
+
+    def _requirements(self) -> typing.Optional[typing.FrozenSet[typing.Tuple[str, typing.Any]]]:
+        if self._overrides(OrSpecification):
+            return super()._requirements()
+        # any child may hold, so all of them must be known
+        found = [spec._requirements() for spec in self.args]
+        if any(requirements is None for requirements in found):
+            return None
+        return frozenset().union(*found)
+
+    def reordered(self, statistics: "CatalogStatistics") -> Specification:
+        if self._overrides(OrSpecification):
+            return super().reordered(statistics)
+        # run the children that are cheap and likely to succeed first
+        args = [spec.reordered(statistics) for spec in self.args]
+        return OrSpecification(*sorted(args, key=lambda spec: statistics.cost(spec) / max(statistics.selectivity(spec), 1e-9)))
+
+    def instrumented(self, counter: "EvaluationCounter") -> Specification:
+        if self._overrides(OrSpecification):
+            return super().instrumented(counter)
+        return OrSpecification(*(spec.instrumented(counter) for spec in self.args))
+
+class NotSpecification(Specification):
+    def __init__(self, spec: Specification):
+        self.spec = spec
+
+    def is_satisfied(self, item: Product) -> bool:
+        return not self.spec.is_satisfied(item)
+
+    def _key(self) -> typing.Hashable:
+        return self.spec
+
+    def _expression(self, constants: typing.List[typing.Any], depth: int = 0) -> str:
+        if self._overrides(NotSpecification):
+            return super()._expression(constants, depth)
+        return f"(not {self.spec._child_expression(constants, depth + 1)})"
+
+    def _lookup(self, catalog: "ProductCatalog") -> typing.Optional[typing.Tuple[typing.Set[int], bool]]:
+        if self._overrides(NotSpecification):
+            return super()._lookup(catalog)
+        # only an exact id set can be complemented
+        found = self.spec._lookup(catalog)
+        if found is None or not found[1]:
+            return None
+        return catalog.products.keys() - found[0], True
+
+    def _mask(self, table: "ProductTable") -> "np.ndarray":
+        if self._overrides(NotSpecification):
+            return super()._mask(table)
+        return ~self.spec._mask(table)
+
+    def _attributes(self) -> typing.Optional[typing.FrozenSet[str]]:
+        if self._overrides(NotSpecification):
+            return super()._attributes()
+        return self.spec._attributes()
+
+    def reordered(self, statistics: "CatalogStatistics") -> Specification:
+        if self._overrides(NotSpecification):
+            return super().reordered(statistics)
+        return NotSpecification(self.spec.reordered(statistics))
+
+    def instrumented(self, counter: "EvaluationCounter") -> Specification:
+        if self._overrides(NotSpecification):
+            return super().instrumented(counter)
+        return NotSpecification(self.spec.instrumented(counter))
+
+class EvaluationCounter:
+    def __init__(self):
+        self.count = 0
+
+# CountingSpecification counts how often the wrapped predicate is evaluated
+class CountingSpecification(Specification):
+    def __init__(self, spec: Specification, counter: EvaluationCounter):
+        self.spec = spec
+        self.counter = counter
+
+    def is_satisfied(self, item: Product) -> bool:
+        self.counter.count += 1
+        return self.spec.is_satisfied(item)
+
 # Now we can create a class called Filter that has a abstract method called filter
 class Filter:
     def filter(self, items: typing.List[Product], spec: Specification):
@@ -102,10 +451,423 @@ class Filter:
 # BetterFilter is a concrete class that inherits from Filter
 class BetterFilter(Filter):
     def filter(self, items: typing.List[Product], spec: Specification):
-        for item in items:
-            if spec.is_satisfied(item):
-                yield item
+        yield from filter(spec.compile(), items)
+
+# FilterView is the live result of a specification over a ProductCatalog.
+# The catalog keeps it up to date on every change, so reading it never rescans the products.
+class FilterView:
+    def __init__(self, catalog: "ProductCatalog", spec: Specification):
+        self.catalog = catalog
+        self.spec = spec
+        self._predicate = spec.compile()
+        # a dict is used as an insertion-ordered set of product ids
+        self._ids: typing.Dict[int, None] = {}
+
+    def _refresh(self, product_id: int, product: Product):
+        if self._predicate(product):
+            if product_id not in self._ids:
+                self._ids[product_id] = None
+                self.catalog._memberships.setdefault(product_id, set()).add(self)
+        elif product_id in self._ids:
+            self._discard(product_id)
+
+    def _discard(self, product_id: int):
+        del self._ids[product_id]
+        self.catalog._memberships[product_id].discard(self)
 
+    def __contains__(self, product: Product) -> bool:
+        return self.catalog._ids.get(product) in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> typing.Iterator[Product]:
+        return (self.catalog.products[product_id] for product_id in self._ids)
+
+# ProductCatalog keeps inverted indexes from every color and size to the ids of its products.
+# The indexes and the registered views are maintained by add, remove and update,
+# so products must not be changed in place.
+class ProductCatalog:
+    _tokens = itertools.count()
+
+    def __init__(self, products: typing.Iterable[Product] = ()):
+        # unique for the life of the process, unlike id(), so caches can key results by it
+        self.token = next(self._tokens)
+        self.products: typing.Dict[int, Product] = {}
+        self.by_color: typing.Dict[Color, typing.Set[int]] = {}
+        self.by_size: typing.Dict[Size, typing.Set[int]] = {}
+        self._ids: typing.Dict[Product, int] = {}
+        self._next_id = 0
+        # incremented by every change, so cached query results can tell that they are stale
+        self.version = 0
+        self.views: typing.List[FilterView] = []
+        # views keyed by each (attribute, value) a product needs to enter them, None for views
+        # that any product may enter
+        self._views_by_requirement: typing.Dict[typing.Optional[typing.Tuple[str, typing.Any]], typing.List[FilterView]] = {}
+        # the views that currently contain each product id
+        self._memberships: typing.Dict[int, typing.Set[FilterView]] = {}
+        for product in products:
+            self.add(product)
+
+    def add(self, product: Product) -> int:
+        product_id = self._ids.get(product)
+        if product_id is not None:
+            return product_id
+
+        product_id = self._next_id
+        self._next_id += 1
+        self.version += 1
+        self.products[product_id] = product
+        self._ids[product] = product_id
+        self.by_color.setdefault(product.color, set()).add(product_id)
+        self.by_size.setdefault(product.size, set()).add(product_id)
+        for view in self._candidate_views(product):
+            view._refresh(product_id, product)
+        return product_id
+
+    # a product can only enter the views whose requirements it meets
+    def _candidate_views(self, product: Product) -> typing.Dict[FilterView, None]:
+        candidates: typing.Dict[FilterView, None] = {}
+        for requirement in (None, ("color", product.color), ("size", product.size)):
+            for view in self._views_by_requirement.get(requirement, ()):
+                candidates[view] = None
+        return candidates
+
+    def remove(self, product: Product):
+        product_id = self._ids.pop(product)
+        del self.products[product_id]
+        self.version += 1
+        self.by_color[product.color].discard(product_id)
+        self.by_size[product.size].discard(product_id)
+        for view in list(self._memberships.pop(product_id, ())):
+            del view._ids[product_id]
+
+    def update(self, product: Product, color: typing.Optional[Color] = None, size: typing.Optional[Size] = None):
+        product_id = self._ids[product]
+        changed = False
+        if color is not None and color != product.color:
+            self.by_color[product.color].discard(product_id)
+            self.by_color.setdefault(color, set()).add(product_id)
+            product.color = color
+            changed = True
+        if size is not None and size != product.size:
+            self.by_size[product.size].discard(product_id)
+            self.by_size.setdefault(size, set()).add(product_id)
+            product.size = size
+            changed = True
+        if not changed:
+            return
+        self.version += 1
+
+        # only the views the product is in can lose it, and only those whose requirements
+        # it now meets can gain it
+        affected = self._candidate_views(product)
+        for view in self._memberships.get(product_id, ()):
+            affected[view] = None
+        for view in affected:
+            view._refresh(product_id, product)
+
+    def add_view(self, spec: Specification) -> FilterView:
+        view = FilterView(self, spec)
+        for product_id, product in self.products.items():
+            view._refresh(product_id, product)
+
+        self.views.append(view)
+        requirements = spec._requirements()
+        for requirement in (requirements if requirements is not None else (None,)):
+            self._views_by_requirement.setdefault(requirement, []).append(view)
+        return view
+
+    def remove_view(self, view: FilterView):
+        self.views.remove(view)
+        for views in self._views_by_requirement.values():
+            if view in views:
+                views.remove(view)
+        for product_id in view._ids:
+            self._memberships[product_id].discard(view)
+        view._ids.clear()
+
+    def __iter__(self) -> typing.Iterator[Product]:
+        return iter(self.products.values())
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+# CatalogStatistics estimates how selective and how expensive a specification is on a catalog.
+# Selectivity comes from the indexes when they answer exactly, otherwise from a sample,
+# and the cost is the measured time of one is_satisfied call on that sample.
+class CatalogStatistics:
+    def __init__(self, catalog: ProductCatalog, sample_size: int = 1_000):
+        self.catalog = catalog
+        products = list(catalog)
+        self.sample: typing.List[Product] = random.sample(products, min(sample_size, len(products)))
+        self._selectivity: typing.Dict[Specification, float] = {}
+        self._cost: typing.Dict[Specification, float] = {}
+
+    def selectivity(self, spec: Specification) -> float:
+        selectivity = self._selectivity.get(spec)
+        if selectivity is None:
+            found = spec._lookup(self.catalog)
+            if found is not None and found[1] and len(self.catalog):
+                selectivity = len(found[0]) / len(self.catalog)
+            elif self.sample:
+                selectivity = sum(1 for item in self.sample if spec.is_satisfied(item)) / len(self.sample)
+            else:
+                selectivity = 0.5
+            self._selectivity[spec] = selectivity
+        return selectivity
+
+    def cost(self, spec: Specification) -> float:
+        cost = self._cost.get(spec)
+        if cost is None:
+            start = time.perf_counter()
+            for item in self.sample:
+                spec.is_satisfied(item)
+            cost = self._cost[spec] = (time.perf_counter() - start) / max(len(self.sample), 1)
+        return cost
+
+# IndexedFilter answers what it can from the catalog indexes and scans for the rest
+class IndexedFilter(Filter):
+    def filter(self, items: typing.Union[ProductCatalog, typing.List[Product]], spec: Specification):
+        found = spec._lookup(items) if isinstance(items, ProductCatalog) else None
+        if found is None:
+            yield from BetterFilter().filter(items, spec)
+            return
+
+        ids, exact = found
+        # ids grow with every insert, so sorting them keeps the insertion order of a scan
+        candidates = (items.products[product_id] for product_id in sorted(ids))
+        yield from candidates if exact else filter(spec.compile(), candidates)
+
+# ProductTable stores a catalog column by column: names in a list, colors and sizes as
+# small integer codes in NumPy arrays, so specifications can be evaluated as vector operations
+class ProductTable:
+    COLORS: typing.List[Color] = list(Color)
+    SIZES: typing.List[Size] = list(Size)
+    COLOR_CODES: typing.Dict[Color, int] = {color: code for code, color in enumerate(COLORS)}
+    SIZE_CODES: typing.Dict[Size, int] = {size: code for code, size in enumerate(SIZES)}
+
+    def __init__(self, products: typing.Iterable[Product] = ()):
+        if np is None:
+            raise ImportError("ProductTable requires NumPy")
+
+        products = list(products)
+        self.names: typing.List[str] = [product.name for product in products]
+        self.colors = np.fromiter((self.COLOR_CODES[product.color] for product in products), dtype=np.int8, count=len(products))
+        self.sizes = np.fromiter((self.SIZE_CODES[product.size] for product in products), dtype=np.int8, count=len(products))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def product(self, index: int) -> Product:
+        # rows are only turned back into Product objects on demand
+        return Product(self.names[index], self.COLORS[self.colors[index]], self.SIZES[self.sizes[index]])
+
+    def select(self, spec: Specification) -> "np.ndarray":
+        return np.flatnonzero(spec._mask(self))
+
+# VectorizedFilter evaluates a specification on a whole ProductTable and lazily yields the matches
+class VectorizedFilter(Filter):
+    def filter(self, items: typing.Union[ProductTable, typing.List[Product]], spec: Specification):
+        if not isinstance(items, ProductTable):
+            yield from BetterFilter().filter(items, spec)
+            return
+
+        for index in items.select(spec):
+            yield items.product(index)
+
+# CachedFilter keeps the results of recent queries on a catalog in a bounded LRU cache keyed by
+# (catalog token, catalog version, specification). Items that are not a ProductCatalog have no version
+# and are passed straight to the inner filter. Results of a catalog that is gone age out of the LRU.
+class CachedFilter(Filter):
+    def __init__(self, inner: typing.Optional[Filter] = None, max_size: int = 128):
+        self.inner = inner or BetterFilter()
+        self.max_size = max_size
+        self._results: "OrderedDict[typing.Tuple[int, int, Specification], typing.List[Product]]" = OrderedDict()
+        # the last version seen of each live catalog
+        self._versions: "weakref.WeakKeyDictionary[ProductCatalog, int]" = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _invalidate(self, catalog: ProductCatalog):
+        # drop every result computed on an older version of this catalog
+        if self._versions.get(catalog, catalog.version) != catalog.version:
+            stale = [key for key in self._results if key[0] == catalog.token]
+            for key in stale:
+                del self._results[key]
+            self.invalidations += len(stale)
+        self._versions[catalog] = catalog.version
+
+    def filter(self, items: typing.Union[ProductCatalog, typing.List[Product]], spec: Specification):
+        if not isinstance(items, ProductCatalog):
+            yield from self.inner.filter(items, spec)
+            return
+
+        self._invalidate(items)
+        key = (items.token, items.version, spec)
+        results = self._results.get(key)
+        if results is not None:
+            self.hits += 1
+            self._results.move_to_end(key)
+        else:
+            self.misses += 1
+            results = self._results[key] = list(self.inner.filter(items, spec))
+            if len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+                self.evictions += 1
+        yield from results
+
+    @property
+    def size(self) -> int:
+        return len(self._results)
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "invalidations": self.invalidations, "size": self.size}
+
+# InstrumentedFilter scans like BetterFilter and reports the predicate evaluations of its last query
+class InstrumentedFilter(Filter):
+    def __init__(self):
+        self.counter = EvaluationCounter()
+
+    @property
+    def evaluations(self) -> int:
+        return self.counter.count
+
+    def filter(self, items: typing.Iterable[Product], spec: Specification):
+        self.counter = EvaluationCounter()
+        yield from BetterFilter().filter(items, spec.instrumented(self.counter))
+
+def _encode_chunk(chunk: typing.List[Product]) -> typing.Tuple[typing.List[str], bytes, bytes]:
+    # products travel to the workers as columns with the enum codes of ProductTable: pickling a list
+    # of names and two byte strings is several times cheaper than pickling Product and Enum objects
+    return ([item.name for item in chunk],
+            bytes([ProductTable.COLOR_CODES[item.color] for item in chunk]),
+            bytes([ProductTable.SIZE_CODES[item.size] for item in chunk]))
+
+def _filter_chunk(spec: Specification, names: typing.List[str], colors: bytes, sizes: bytes) -> typing.List[int]:
+    # runs in a worker process; only the offsets of the matches travel back
+    predicate = spec.compile()
+    items = map(Product, names, [ProductTable.COLORS[code] for code in colors], [ProductTable.SIZES[code] for code in sizes])
+    return [offset for offset, item in enumerate(items) if predicate(item)]
+
+def _filter_products(spec: Specification, chunk: typing.List[Product]) -> typing.List[int]:
+    # runs in a worker process, for specifications that read more of a product than the columns carry
+    predicate = spec.compile()
+    return [offset for offset, item in enumerate(chunk) if predicate(item)]
+
+# ParallelFilter evaluates the specification on chunks of the products in a process pool.
+# Matches are yielded in their original order while later chunks are still being evaluated.
+# Products are sent as columns when the specification only reads their color and size, and
+# pickled whole otherwise, so that specifications on other attributes of subclasses still work.
+class ParallelFilter(Filter):
+    COLUMNS = frozenset({"color", "size"})
+
+    def __init__(self, workers: typing.Optional[int] = None, chunk_size: int = 50_000):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self._executor: typing.Optional[ProcessPoolExecutor] = None
+
+    def filter(self, items: typing.Iterable[Product], spec: Specification):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers)
+
+        attributes = spec._attributes()
+        columns = attributes is not None and attributes <= self.COLUMNS
+
+        # keep a bounded number of chunks in flight so that huge inputs are not submitted at once
+        pending: typing.Deque[typing.Tuple[typing.List[Product], Future]] = deque()
+        items = iter(items)
+        while True:
+            while len(pending) < 2 * self.workers:
+                chunk = list(itertools.islice(items, self.chunk_size))
+                if not chunk:
+                    break
+                if columns:
+                    future = self._executor.submit(_filter_chunk, spec, *_encode_chunk(chunk))
+                else:
+                    future = self._executor.submit(_filter_products, spec, chunk)
+                pending.append((chunk, future))
+            if not pending:
+                return
+
+            chunk, future = pending.popleft()
+            for offset in future.result():
+                yield chunk[offset]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> "ParallelFilter":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def make_products(count: int) -> typing.List[Product]:
+    colors = list(Color)
+    sizes = list(Size)
+    return [Product(f"product{i}", random.choice(colors), random.choice(sizes)) for i in range(count)]
+
+def benchmark_compiled_filter(product_count: int = 1_000_000):
+    products = make_products(product_count)
+    spec = AndSpecification(
+        ColorSpecification(Color.RED),
+        AndSpecification(SizeSpecification(Size.LARGE), ColorSpecification(Color.RED)))
+
+    start = time.perf_counter()
+    expected = [item for item in products if spec.is_satisfied(item)]
+    tree_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found = list(BetterFilter().filter(products, spec))
+    compiled_time = time.perf_counter() - start
+
+    assert found == expected
+    print(f"{product_count:,} products, {len(found):,} matches:")
+    print(f"  is_satisfied tree {tree_time / product_count * 1e9:8.1f} ns/item")
+    print(f"  compiled          {compiled_time / product_count * 1e9:8.1f} ns/item")
+
+def benchmark_vectorized_filter(product_counts: typing.Iterable[int] = (10_000, 100_000, 1_000_000, 10_000_000)):
+    spec = AndSpecification(ColorSpecification(Color.RED), SizeSpecification(Size.LARGE))
+    for product_count in product_counts:
+        products = make_products(product_count)
+        table = ProductTable(products)
+
+        start = time.perf_counter()
+        expected = list(BetterFilter().filter(products, spec))
+        scan_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        indexes = table.select(spec)
+        vectorized_time = time.perf_counter() - start
+
+        assert [products[index] for index in indexes] == expected
+        print(f"{product_count:>12,} products: BetterFilter {scan_time * 1e3:10.2f} ms, "
+              f"ProductTable {vectorized_time * 1e3:10.2f} ms ({scan_time / vectorized_time:6.1f}x)")
+
+def benchmark_parallel_filter(product_count: int = 1_000_000, max_workers: typing.Optional[int] = None):
+    products = make_products(product_count)
+    spec = AndSpecification(ColorSpecification(Color.RED), OrSpecification(SizeSpecification(Size.LARGE), SizeSpecification(Size.SMALL)))
+
+    start = time.perf_counter()
+    expected = list(BetterFilter().filter(products, spec))
+    print(f"{product_count:,} products:")
+    print(f"  BetterFilter        {product_count / (time.perf_counter() - start):12,.0f} items/s")
+
+    for workers in range(1, (max_workers or os.cpu_count() or 1) + 1):
+        with ParallelFilter(workers) as parallel_filter:
+            # warm up the pool so that process start-up is not measured
+            list(parallel_filter.filter(products[:workers], spec))
+            start = time.perf_counter()
+            found = list(parallel_filter.filter(products, spec))
+            elapsed = time.perf_counter() - start
+        assert found == expected
+        print(f"  ParallelFilter({workers:>2}) {product_count / elapsed:12,.0f} items/s")
 
 if __name__ == "__main__":
     # Create some products
@@ -134,4 +896,65 @@ if __name__ == "__main__":
     for product in better_filter.filter(products, large_blue):
         print(f"{product.name} is large and green")
 
+    print("\nThe following uses the indexes of a product catalog")
+    catalog = ProductCatalog(products)
+    indexed_filter = IndexedFilter()
+    for product in indexed_filter.filter(catalog, large_blue):
+        print(f"{product.name} is large and green")
+
+    catalog.remove(product3)
+    catalog.add(Product("Frog", Color.GREEN, Size.SMALL))
+    for product in indexed_filter.filter(catalog, green_specification):
+        print(f"{product.name} is green")
+
+    if np is not None:
+        print("\nThe following evaluates the specifications on a columnar product table")
+        table = ProductTable(products)
+        vectorized_filter = VectorizedFilter()
+        for product in vectorized_filter.filter(table, large_blue):
+            print(f"{product.name} is large and green")
+        print(f"Rows that are green: {table.select(green_specification)}")
+
+    print("\nThe following reorders the specifications by cost and selectivity")
+    # almost everything is red, but large products are rare
+    skewed_catalog = ProductCatalog(
+        Product(f"product{i}", Color.RED if i % 10 else Color.BLUE, Size.LARGE if i % 50 == 7 else Size.SMALL)
+        for i in range(10_000))
+    statistics = CatalogStatistics(skewed_catalog)
+    instrumented_filter = InstrumentedFilter()
+    red_and_large = AndSpecification(ColorSpecification(Color.RED), SizeSpecification(Size.LARGE))
+    not_small_or_red = OrSpecification(NotSpecification(SizeSpecification(Size.SMALL)), ColorSpecification(Color.RED))
+    for spec in (red_and_large, not_small_or_red):
+        for label, query in (("as declared", spec), ("reordered", spec.reordered(statistics))):
+            count = sum(1 for _ in instrumented_filter.filter(skewed_catalog, query))
+            print(f"{type(spec).__name__} {label}: {count} matches, {instrumented_filter.evaluations} evaluations")
+
+    print("\nThe following filters the skewed catalog in a process pool")
+    with ParallelFilter(workers=2, chunk_size=1_000) as parallel_filter:
+        large = list(parallel_filter.filter(skewed_catalog, SizeSpecification(Size.LARGE)))
+        print(f"{len(large)} large products, the first is {large[0].name}")
+
+    print("\nThe following keeps a live view of the green products")
+    green_view = catalog.add_view(green_specification)
+    print(f"Green products: {[product.name for product in green_view]}")
+    catalog.update(product1, color=Color.GREEN)
+    catalog.remove(product2)
+    print(f"Green products after Apple turned green: {[product.name for product in green_view]}")
+    print(f"Is Apple green? {product1 in green_view}")
+
+    print("\nThe following caches the query results")
+    cached_filter = CachedFilter(max_size=2)
+    red_and_small = AndSpecification(ColorSpecification(Color.RED), SizeSpecification(Size.SMALL))
+    small_and_red = AndSpecification(SizeSpecification(Size.SMALL), ColorSpecification(Color.RED))
+    print(f"Equal specifications in a different order: {red_and_small == small_and_red}")
+    for spec in (red_and_small, small_and_red, green_specification, large_specification, red_and_small):
+        list(cached_filter.filter(catalog, spec))
+    catalog.update(product1, color=Color.RED)
+    print(f"Red and small after Apple turned red again: {[product.name for product in cached_filter.filter(catalog, small_and_red)]}")
+    print(f"Cache statistics: {cached_filter.stats()}")
+
+    #benchmark_compiled_filter()
+    #benchmark_vectorized_filter()
+    #benchmark_parallel_filter()
+
     
\ No newline at end of file
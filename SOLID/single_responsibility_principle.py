@@ -17,16 +17,60 @@
 # Author: Wei-Chih Lin (weichih.lin@protonmail.com)
 ##########################################################################
 
+from array import array
+import bisect
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import mmap
+import os
+import queue
+import random
+import re
+import statistics
+import struct
+import tempfile
+import threading
+import time
+import typing
+import urllib.request
+import zlib
+
+# The binary journal format:
+#   header  "JRNL" and a version byte
+#   blocks  zlib-compressed runs of records, each record a little-endian u32 length and UTF-8 bytes
+#   index   one (offset u64, compressed size u32, first entry u64, entry count u32) row per block
+#   footer  index offset u64, block count u32 and "JRNL" again
+BINARY_MAGIC = b"JRNL"
+BINARY_VERSION = 1
+BINARY_BLOCK_BYTES = 16 * 1024
+_RECORD_LENGTH = struct.Struct("<I")
+_BLOCK_ROW = struct.Struct("<QIQI")
+_FOOTER = struct.Struct("<QI4s")
+
 class Journal(list):
     def __init__(self):
         super().__init__()
         self.count = 0
+        # entries added ("+") and removed ("-") since the last incremental save,
+        # None until an AppendOnlyPersistenceManager starts tracking the journal
+        self.changes: typing.Optional[typing.List[typing.Tuple[str, str]]] = None
+        # optional full-text index keyed by the "{count}: " prefix of the entries
+        self.index: typing.Optional[JournalIndex] = None
     
     def add_entry(self, text):
-        self.append(f'{self.count}: {text}')
+        entry = f'{self.count}: {text}'
+        self.append(entry)
+        if self.index is not None:
+            self.index.add(self.count, text)
         self.count += 1
+        if self.changes is not None:
+            self.changes.append(("+", entry))
 
     def remove_entry(self, index):
+        if self.changes is not None:
+            self.changes.append(("-", self[index]))
+        if self.index is not None:
+            self.index.remove_line(self[index])
         del self[index]
     
     def __str__(self) -> str:
@@ -38,16 +82,766 @@ class Journal(list):
             file.write(str(self))
     
     def load(self, filename):
-        pass
+        PersistenceManager.load_from_file(filename, self)
 
     def load_from_web(self, uri):
-        pass
+        PersistenceManager.load_from_web(uri, self)
+
+# JournalStore gives every entry a stable integer id, the same number as its "{id}: " prefix.
+# Entries live in a dict, so adding and removing by id are both O(1) and ids keep matching
+# their entries after a removal. It renders line by line instead of joining one big string.
+class JournalStore:
+    def __init__(self):
+        self.entries: typing.Dict[int, str] = {}
+        self.count = 0
+        # same change tracking as Journal, so both work with the persistence managers
+        self.changes: typing.Optional[typing.List[typing.Tuple[str, str]]] = None
+        self.index: typing.Optional[JournalIndex] = None
+
+    def add_entry(self, text) -> int:
+        entry_id = self.count
+        self.entries[entry_id] = text
+        self.count += 1
+        if self.changes is not None:
+            self.changes.append(("+", f"{entry_id}: {text}"))
+        if self.index is not None:
+            self.index.add(entry_id, text)
+        return entry_id
+
+    def remove_entry(self, entry_id):
+        text = self.entries.pop(entry_id)
+        if self.changes is not None:
+            self.changes.append(("-", f"{entry_id}: {text}"))
+        if self.index is not None:
+            self.index.remove(entry_id, text)
+
+    def append(self, entry):
+        # used by the loaders: keep the id of a saved "{id}: text" line
+        prefix, separator, text = entry.partition(": ")
+        if separator and prefix.isdecimal():
+            self.entries[int(prefix)] = text
+        else:
+            self.entries[self.count] = entry
+            self.count += 1
+
+    def __getitem__(self, entry_id) -> str:
+        return self.entries[entry_id]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> typing.Iterator[str]:
+        for entry_id, text in self.entries.items():
+            yield f"{entry_id}: {text}"
+
+    def lines(self) -> typing.Iterator[str]:
+        # the rendered journal as a stream of lines, each ending with a newline but the last
+        return PersistenceManager._lines(self)
+
+    def __str__(self) -> str:
+        return "".join(self.lines())
+
+# JournalIndex is an inverted index from lower-cased words to the ids of the entries that
+# contain them. Journal and JournalStore keep it up to date once it is assigned to their index.
+# Queries cost as much as the postings they read: find returns the stored id set itself,
+# which callers must not modify, and find_all only walks the rarest term's ids.
+# SortedTerms keeps strings in order as a list of blocks of at most 2 * LOAD strings,
+# so adding or removing one shifts a single block instead of the whole list
+class SortedTerms:
+    LOAD = 512
+
+    def __init__(self, terms: typing.Iterable[str] = ()):
+        ordered = sorted(terms)
+        self._blocks: typing.List[typing.List[str]] = [ordered[i:i + self.LOAD] for i in range(0, len(ordered), self.LOAD)]
+        # the last string of every block, to find the block of a string by bisection
+        self._maxes: typing.List[str] = [block[-1] for block in self._blocks]
+        self._length = len(ordered)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> typing.Iterator[str]:
+        for block in self._blocks:
+            yield from block
+
+    def add(self, term: str):
+        self._length += 1
+        if not self._blocks:
+            self._blocks.append([term])
+            self._maxes.append(term)
+            return
+        position = bisect.bisect_left(self._maxes, term)
+        if position == len(self._maxes):
+            position -= 1
+            self._blocks[position].append(term)
+            self._maxes[position] = term
+        else:
+            bisect.insort(self._blocks[position], term)
+        block = self._blocks[position]
+        if len(block) > 2 * self.LOAD:
+            self._blocks[position:position + 1] = [block[:self.LOAD], block[self.LOAD:]]
+            self._maxes.insert(position, block[self.LOAD - 1])
+
+    def remove(self, term: str):
+        position = bisect.bisect_left(self._maxes, term)
+        block = self._blocks[position] if position < len(self._blocks) else []
+        offset = bisect.bisect_left(block, term)
+        if offset == len(block) or block[offset] != term:
+            raise ValueError(f"{term!r} is not in the terms")
+        del block[offset]
+        self._length -= 1
+        if block:
+            self._maxes[position] = block[-1]
+        else:
+            del self._blocks[position]
+            del self._maxes[position]
+
+    def from_term(self, start: str) -> typing.Iterator[str]:
+        # every string from start on, in order
+        position = bisect.bisect_left(self._maxes, start)
+        for block in self._blocks[position:position + 1]:
+            for offset in range(bisect.bisect_left(block, start), len(block)):
+                yield block[offset]
+        for block in self._blocks[position + 1:]:
+            yield from block
+
+class JournalIndex:
+    WORD = re.compile(r"\w+")
+    _NO_IDS: typing.AbstractSet[int] = frozenset()
+
+    def __init__(self):
+        self.postings: typing.Dict[str, typing.Set[int]] = {}
+        # every indexed term in order, for prefix queries
+        self.terms = SortedTerms()
+
+    @classmethod
+    def tokenize(cls, text) -> typing.Set[str]:
+        return set(cls.WORD.findall(text.lower()))
+
+    @classmethod
+    def build(cls, journal) -> "JournalIndex":
+        index = cls()
+        for line in journal:
+            index.add_line(line)
+        return index
+
+    def add(self, entry_id, text):
+        for term in self.tokenize(text):
+            ids = self.postings.get(term)
+            if ids is None:
+                ids = self.postings[term] = set()
+                self.terms.add(term)
+            ids.add(entry_id)
+
+    def remove(self, entry_id, text):
+        for term in self.tokenize(text):
+            ids = self.postings.get(term)
+            if ids is None:
+                continue
+            ids.discard(entry_id)
+            if not ids:
+                del self.postings[term]
+                self.terms.remove(term)
+
+    @staticmethod
+    def _split(line) -> typing.Tuple[int, str]:
+        prefix, _, text = line.partition(": ")
+        return int(prefix), text
+
+    def add_line(self, line):
+        self.add(*self._split(line))
+
+    def remove_line(self, line):
+        self.remove(*self._split(line))
+
+    def find(self, term) -> typing.AbstractSet[int]:
+        return self.postings.get(term.lower(), self._NO_IDS)
+
+    def find_all(self, *terms) -> typing.AbstractSet[int]:
+        # intersect starting from the rarest term, stopping as soon as nothing is left
+        id_sets = sorted((self.find(term) for term in terms), key=len)
+        if not id_sets:
+            return self._NO_IDS
+        if len(id_sets) == 1:
+            return id_sets[0]
+        ids = id_sets[0] & id_sets[1]
+        for other in id_sets[2:]:
+            if not ids:
+                break
+            ids &= other
+        return ids
+
+    def find_any(self, *terms) -> typing.Set[int]:
+        return set().union(*(self.find(term) for term in terms))
+
+    def find_prefix(self, prefix) -> typing.Set[int]:
+        prefix = prefix.lower()
+        ids: typing.Set[int] = set()
+        for term in self.terms.from_term(prefix):
+            if not term.startswith(prefix):
+                break
+            ids |= self.postings[term]
+        return ids
 
 class PersistenceManager:
+    @staticmethod
+    def _lines(journal):
+        entries = iter(journal)
+        first = next(entries, None)
+        if first is None:
+            return
+        yield first
+        for entry in entries:
+            yield f"\n{entry}"
+
     @staticmethod
     def save_to_file(journal, filename):
+        # streams the entries, writing the same text as str(journal)
         with open(filename, "w" ) as file:
-            file.write(str(journal))
+            file.writelines(PersistenceManager._lines(journal))
+        if getattr(journal, "index", None) is not None:
+            PersistenceManager.save_index(journal.index, f"{filename}.index")
+        elif os.path.exists(f"{filename}.index"):
+            # never leave the index of an older save next to this one
+            os.remove(f"{filename}.index")
+
+    # the index is saved next to the journal, one "term id id ..." line per term
+    @staticmethod
+    def save_index(index, filename):
+        with open(filename, "w", encoding="utf-8") as file:
+            for term in index.terms:
+                file.write(f"{term} {' '.join(map(str, index.postings[term]))}\n")
+
+    @staticmethod
+    def load_index(filename):
+        index = JournalIndex()
+        with open(filename, encoding="utf-8") as file:
+            for line in file:
+                term, *ids = line.split()
+                index.postings[term] = set(map(int, ids))
+        # saved in order, so sorting the terms takes linear time
+        index.terms = SortedTerms(index.postings)
+        return index
+
+    @staticmethod
+    def _read_into(journal, lines):
+        # entries keep their "{count}: " prefix, the next count continues after the largest one
+        for line in lines:
+            entry = line.rstrip("\n")
+            journal.append(entry)
+            prefix, separator, _ = entry.partition(": ")
+            if separator and prefix.isdecimal():
+                journal.count = max(journal.count, int(prefix) + 1)
+        return journal
+
+    # both loaders stream the journal line by line instead of reading it into memory at once
+    @staticmethod
+    def load_from_file(filename, journal=None):
+        with open(filename, encoding="utf-8") as file:
+            journal = PersistenceManager._read_into(journal if journal is not None else Journal(), file)
+        if os.path.exists(f"{filename}.index"):
+            journal.index = PersistenceManager.load_index(f"{filename}.index")
+        return journal
+
+    @staticmethod
+    def load_from_web(uri, journal=None):
+        with urllib.request.urlopen(uri) as response:
+            lines = io.TextIOWrapper(response, encoding="utf-8")
+            return PersistenceManager._read_into(journal if journal is not None else Journal(), lines)
+
+    @staticmethod
+    def save_to_binary_file(journal, filename, block_bytes=BINARY_BLOCK_BYTES):
+        write_binary_journal(journal, filename, block_bytes)
+
+    @staticmethod
+    def convert_text_to_binary(text_filename, binary_filename, block_bytes=BINARY_BLOCK_BYTES):
+        with open(text_filename, encoding="utf-8") as file:
+            write_binary_journal((line.rstrip("\n") for line in file), binary_filename, block_bytes)
+
+def write_binary_journal(entries, filename, block_bytes=BINARY_BLOCK_BYTES):
+    rows = []
+    with open(filename, "wb") as file:
+        file.write(BINARY_MAGIC + bytes([BINARY_VERSION]))
+        block = bytearray()
+        first_entry = entry_count = 0
+
+        def write_block():
+            compressed = zlib.compress(bytes(block))
+            rows.append(_BLOCK_ROW.pack(file.tell(), len(compressed), first_entry, entry_count))
+            file.write(compressed)
+
+        for entry in entries:
+            data = entry.encode("utf-8")
+            block += _RECORD_LENGTH.pack(len(data))
+            block += data
+            entry_count += 1
+            if len(block) >= block_bytes:
+                write_block()
+                first_entry += entry_count
+                block.clear()
+                entry_count = 0
+        if entry_count:
+            write_block()
+
+        index_offset = file.tell()
+        file.writelines(rows)
+        file.write(_FOOTER.pack(index_offset, len(rows), BINARY_MAGIC))
+
+# BinaryJournalView reads single entries of a binary journal, decompressing only their block
+class BinaryJournalView:
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, "rb")
+        try:
+            index = self._read_index()
+        except ValueError:
+            self._file.close()
+            raise
+        self._blocks = list(_BLOCK_ROW.iter_unpack(index))
+        self._first_entries = [first_entry for _, _, first_entry, _ in self._blocks]
+        self._length = sum(entry_count for *_, entry_count in self._blocks)
+        # the last decompressed block, consecutive reads usually hit it again
+        self._cached_block = -1
+        self._cached_data = b""
+
+    def _read_index(self) -> bytes:
+        # empty, truncated and foreign files all fail here with a ValueError
+        header_size = len(BINARY_MAGIC) + 1
+        file_size = os.fstat(self._file.fileno()).st_size
+        header = self._file.read(header_size)
+        if len(header) < header_size or header[:len(BINARY_MAGIC)] != BINARY_MAGIC or header[-1] != BINARY_VERSION:
+            raise ValueError(f"{self.filename} is not a binary journal")
+
+        if file_size < header_size + _FOOTER.size:
+            raise ValueError(f"{self.filename} has no block index")
+        self._file.seek(-_FOOTER.size, os.SEEK_END)
+        index_offset, block_count, magic = _FOOTER.unpack(self._file.read(_FOOTER.size))
+        if magic != BINARY_MAGIC or index_offset + block_count * _BLOCK_ROW.size > file_size - _FOOTER.size:
+            raise ValueError(f"{self.filename} has no block index")
+        self._file.seek(index_offset)
+        return self._file.read(block_count * _BLOCK_ROW.size)
+
+    def _block(self, block_number):
+        if block_number != self._cached_block:
+            offset, size, _, _ = self._blocks[block_number]
+            self._file.seek(offset)
+            self._cached_block, self._cached_data = block_number, zlib.decompress(self._file.read(size))
+        return self._cached_data
+
+    def _records(self, block_number, skip=0, count=None):
+        # walk the length prefixes, only the requested records are decoded
+        data = self._block(block_number)
+        if count is None:
+            count = self._blocks[block_number][3] - skip
+        position = 0
+        for _ in range(skip):
+            position += _RECORD_LENGTH.unpack_from(data, position)[0] + _RECORD_LENGTH.size
+        for _ in range(count):
+            (length,) = _RECORD_LENGTH.unpack_from(data, position)
+            position += _RECORD_LENGTH.size
+            yield data[position:position + length].decode("utf-8")
+            position += length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("journal entry index out of range")
+        block_number = bisect.bisect_right(self._first_entries, index) - 1
+        return next(self._records(block_number, index - self._first_entries[block_number], 1))
+
+    def __iter__(self):
+        for block_number in range(len(self._blocks)):
+            yield from self._records(block_number)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# JournalView is a read-only view of a saved journal backed by mmap. The offsets of the entries
+# are only indexed on first access, after that any entry is read without touching the others.
+class JournalView:
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, "rb")
+        # an empty file cannot be mapped
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._offsets = None
+
+    def _index(self):
+        if self._offsets is None:
+            # offsets[i] is where entry i starts, the last value is one past the final newline
+            offsets = array("Q", [0])
+            if self._map is not None:
+                position = self._map.find(b"\n")
+                while position != -1:
+                    offsets.append(position + 1)
+                    position = self._map.find(b"\n", position + 1)
+                if offsets[-1] != len(self._map):
+                    offsets.append(len(self._map) + 1)
+            self._offsets = offsets
+        return self._offsets
+
+    def __len__(self):
+        return len(self._index()) - 1
+
+    def __getitem__(self, index):
+        offsets = self._index()
+        if index < 0:
+            index += len(offsets) - 1
+        if not 0 <= index < len(offsets) - 1:
+            raise IndexError("journal entry index out of range")
+        return self._map[offsets[index]:offsets[index + 1] - 1].decode("utf-8")
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# ChunkedFileHandler serves the files of the current directory with chunked transfer encoding,
+# a local stand-in for a journal on the web
+class ChunkedFileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    chunk_size = 16
+
+    def do_GET(self):
+        filename = os.path.basename(self.path)
+        if not os.path.isfile(filename):
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        with open(filename, "rb") as file:
+            while chunk := file.read(self.chunk_size):
+                self.wfile.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+# AppendOnlyPersistenceManager saves a journal as a log: every save appends the entries added
+# since the previous save and a tombstone for every removed entry, so a save costs as much as
+# the change, not the journal. Once the log holds too many stale records it is compacted.
+class AppendOnlyPersistenceManager:
+    ADD = "+"
+    REMOVE = "-"
+
+    def __init__(self, filename, compact_ratio=2.0, min_compact_records=1_000):
+        self.filename = filename
+        self.compact_ratio = compact_ratio
+        self.min_compact_records = min_compact_records
+        self.records = 0
+
+    def save(self, journal):
+        if journal.changes is None or not os.path.exists(self.filename):
+            self.compact(journal)
+            return
+        if not journal.changes:
+            return
+
+        # only the changes written are removed, so one appended meanwhile waits for the next save
+        count = len(journal.changes)
+        with open(self.filename, "a") as file:
+            file.writelines(f"{operation}{entry}\n" for operation, entry in journal.changes[:count])
+        self.records += count
+        del journal.changes[:count]
+
+        # compaction is O(n), but it only runs after O(n) appended records
+        if self.records > max(self.compact_ratio * len(journal), self.min_compact_records):
+            self.compact(journal)
+
+    def compact(self, journal):
+        # write a fresh log next to the old one and swap it in, so a crash never loses both
+        temporary_filename = f"{self.filename}.tmp"
+        with open(temporary_filename, "w") as file:
+            file.writelines(f"{self.ADD}{entry}\n" for entry in journal)
+        os.replace(temporary_filename, self.filename)
+        self.records = len(journal)
+        journal.changes = []
+
+    @classmethod
+    def replay(cls, filename):
+        # a dict is used as an insertion-ordered set of the live entries
+        entries = {}
+        with open(filename) as file:
+            for line in file:
+                operation, entry = line[0], line[1:].rstrip("\n")
+                if operation == cls.ADD:
+                    entries[entry] = None
+                elif operation == cls.REMOVE:
+                    entries.pop(entry, None)
+        return list(entries)
+
+# AsyncPersistenceManager appends the same log records as AppendOnlyPersistenceManager, but on
+# a background writer thread fed by a bounded queue. The writer takes every pending save at once,
+# writes them with one write call and syncs them with one fsync (group commit).
+# The fsync policy is "always" (after every group), "interval" (at most every fsync_interval
+# seconds) or "never" (only on flush and close). It does not compact the log.
+class AsyncPersistenceManager:
+    FSYNC_POLICIES = ("always", "interval", "never")
+
+    def __init__(self, filename, fsync="always", fsync_interval=1.0, max_queue=1024):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {self.FSYNC_POLICIES}, not {fsync!r}")
+        self.filename = filename
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        # (sequence, records) pairs, records is None for a flush request
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._enqueue_lock = threading.Lock()
+        self._sequence = 0
+        self._durable = threading.Condition()
+        self._durable_sequence = 0
+        self._error = None
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._writer.start()
+
+    def _enqueue(self, records):
+        with self._enqueue_lock:
+            return self._enqueue_locked(records)
+
+    def _enqueue_locked(self, records):
+        if self._closed:
+            raise ValueError("AsyncPersistenceManager is closed")
+        # blocks while the queue is full, which slows producers down to the disk,
+        # but gives up as soon as the writer has died and will never drain it
+        while True:
+            if self._error is not None:
+                raise self._error
+            try:
+                self._queue.put((self._sequence + 1, records), timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self._sequence += 1
+        return self._sequence
+
+    def save(self, journal):
+        # queue the changes since the last save and return a ticket for wait(). Taking the
+        # changes and queueing them happen under one lock, so concurrent saves neither take
+        # the same changes twice nor queue them in a different order than they were taken
+        with self._enqueue_lock:
+            if journal.changes is None:
+                # start tracking before the snapshot: an entry added in between is saved twice,
+                # which replaying the log ignores, instead of not at all
+                journal.changes = []
+                records = [f"{AppendOnlyPersistenceManager.ADD}{entry}\n" for entry in list(journal)]
+            else:
+                # add_entry may keep appending meanwhile: only the changes taken are deleted
+                changes = journal.changes
+                count = len(changes)
+                records = [f"{operation}{entry}\n" for operation, entry in changes[:count]]
+                del changes[:count]
+            return self._enqueue_locked(records)
+
+    def wait(self, ticket):
+        # block until everything up to the ticket is on disk; with fsync "never" nothing
+        # is synced unless asked for, so waiting asks for it like flush does
+        if self.fsync == "never" and self._durable_sequence < ticket:
+            ticket = self._enqueue(None)
+        self._wait_durable(ticket)
+
+    def _wait_durable(self, ticket):
+        with self._durable:
+            self._durable.wait_for(lambda: self._durable_sequence >= ticket or self._error is not None)
+        if self._error is not None:
+            raise self._error
+
+    def flush(self):
+        self._wait_durable(self._enqueue(None))
+
+    def close(self):
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            with self._enqueue_lock:
+                self._closed = True
+                if self._writer.is_alive():
+                    self._queue.put((self._sequence, ()))
+            self._writer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _run(self):
+        try:
+            with open(self.filename, "a") as file:
+                last_sync = time.monotonic()
+                unsynced = False
+                # the highest sequence whose records are in the file
+                written = 0
+                while not (self._closed and self._queue.empty()):
+                    # an idle writer still wakes up to honour the fsync interval
+                    timeout = self.fsync_interval if unsynced and self.fsync == "interval" else None
+                    try:
+                        batch = [self._queue.get(timeout=timeout)]
+                    except queue.Empty:
+                        batch = []
+                    while True:
+                        try:
+                            batch.append(self._queue.get_nowait())
+                        except queue.Empty:
+                            break
+
+                    records = [record for _, group in batch if group for record in group]
+                    if records:
+                        file.writelines(records)
+                        file.flush()
+                        unsynced = True
+                    if batch:
+                        written = max(written, max(sequence for sequence, _ in batch))
+
+                    flush_requested = any(group is None for _, group in batch)
+                    if unsynced and (flush_requested or self.fsync == "always" or (
+                            self.fsync == "interval" and time.monotonic() - last_sync >= self.fsync_interval)):
+                        os.fsync(file.fileno())
+                        last_sync = time.monotonic()
+                        unsynced = False
+
+                    if not unsynced and written > self._durable_sequence:
+                        with self._durable:
+                            self._durable_sequence = written
+                            self._durable.notify_all()
+        except BaseException as error:
+            # whatever stopped the writer, waiters and producers must not block on it forever
+            with self._durable:
+                self._error = error
+                self._durable.notify_all()
+
+def benchmark_persist_latency(threads=8, entries_per_thread=200):
+    # latency of adding one entry and waiting until it is persisted, from many threads at once
+    def measure(add_and_persist):
+        latencies = []
+        def worker():
+            for i in range(entries_per_thread):
+                start = time.perf_counter()
+                add_and_persist(f"entry {i}")
+                latencies.append(time.perf_counter() - start)
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        p50, p95, p99 = (statistics.quantiles(latencies, n=100)[k] for k in (49, 94, 98))
+        return f"p50 {p50 * 1e3:8.3f} ms, p95 {p95 * 1e3:8.3f} ms, p99 {p99 * 1e3:8.3f} ms"
+
+    with tempfile.TemporaryDirectory() as directory:
+        lock = threading.Lock()
+
+        journal = Journal()
+        filename = os.path.join(directory, "journal.txt")
+        def save_to_file(text):
+            with lock:
+                journal.add_entry(text)
+                PersistenceManager.save_to_file(journal, filename)
+        print(f"PersistenceManager.save_to_file      {measure(save_to_file)}")
+
+        for fsync in AsyncPersistenceManager.FSYNC_POLICIES:
+            journal = Journal()
+            with AsyncPersistenceManager(os.path.join(directory, f"journal-{fsync}.log"), fsync) as manager:
+                def save_async(text):
+                    # add_entry numbers the entries, so it needs the lock; save does not
+                    with lock:
+                        journal.add_entry(text)
+                    ticket = manager.save(journal)
+                    if fsync == "always":
+                        manager.wait(ticket)
+                print(f"AsyncPersistenceManager({fsync:<8})   {measure(save_async)}")
+
+def benchmark_journal_store(adds=1_000_000, removals=100_000):
+    for journal_type in (Journal, JournalStore):
+        journal = journal_type()
+        start = time.perf_counter()
+        for i in range(adds):
+            journal.add_entry(f"entry {i}")
+        add_time = time.perf_counter() - start
+
+        if journal_type is Journal:
+            # a list can only remove by position
+            targets = [random.randrange(adds - i) for i in range(removals)]
+        else:
+            targets = random.sample(range(adds), removals)
+        start = time.perf_counter()
+        for target in targets:
+            journal.remove_entry(target)
+        remove_time = time.perf_counter() - start
+
+        print(f"{journal_type.__name__:<12} {adds:,} adds {add_time:8.3f}s, {removals:,} removals {remove_time:8.3f}s")
+
+def benchmark_journal_index(entries=1_000_000, queries=1_000):
+    # entries of a few words each, from a vocabulary of rare ids, a few thousand words and two very common ones
+    words = [f"word{i}" for i in range(5_000)]
+    journal = JournalStore()
+    journal.index = JournalIndex()
+    start = time.perf_counter()
+    for i in range(entries):
+        journal.add_entry(f"entry {i} {random.choice(words)} {random.choice(words)} note")
+    add_time = time.perf_counter() - start
+    print(f"{entries:,} indexed adds {add_time / entries * 1e6:8.2f} us/entry, {len(journal.index.postings):,} terms")
+
+    for label, query in (("find(rare)", lambda: journal.index.find(random.choice(words))),
+                         ("find(common)", lambda: journal.index.find("note")),
+                         ("find_all(rare, common)", lambda: journal.index.find_all(random.choice(words), "entry")),
+                         ("find_prefix(word123)", lambda: journal.index.find_prefix("word123"))):
+        start = time.perf_counter()
+        for _ in range(queries):
+            query()
+        print(f"  {label:<24} {(time.perf_counter() - start) / queries * 1e3:8.3f} ms")
+
+def benchmark_binary_journal(entries=1_000_000, reads=10_000):
+    journal = Journal()
+    for i in range(entries):
+        journal.add_entry(f"I went to the zoo and saw animal number {random.randrange(1_000)}")
+    indexes = [random.randrange(entries) for _ in range(reads)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        text_filename = os.path.join(directory, "journal.txt")
+        binary_filename = os.path.join(directory, "journal.bin")
+        for label, save, filename, view_type in (
+                ("text", PersistenceManager.save_to_file, text_filename, JournalView),
+                ("binary", PersistenceManager.save_to_binary_file, binary_filename, BinaryJournalView)):
+            start = time.perf_counter()
+            save(journal, filename)
+            write_time = time.perf_counter() - start
+
+            with view_type(filename) as view:
+                # the first access builds the offset index of a text view
+                view[0]
+                start = time.perf_counter()
+                for index in indexes:
+                    view[index]
+                read_time = time.perf_counter() - start
+
+            print(f"{label:<6} {os.path.getsize(filename) / 2**20:8.2f} MiB, "
+                  f"write {entries / write_time:12,.0f} entries/s, random read {read_time / reads * 1e6:8.2f} us")
 
 if __name__ == "__main__":
     journal = Journal()
@@ -58,4 +852,61 @@ if __name__ == "__main__":
     PersistenceManager.save_to_file(journal, "journal.txt")
     with open("journal.txt") as file:
         print("After saving, read the content form the file:")
-        print(file.read())
\ No newline at end of file
+        print(file.read())
+
+    persistence_manager = AppendOnlyPersistenceManager("journal.log")
+    persistence_manager.save(journal)
+    journal.add_entry("I went to the zoo")
+    journal.remove_entry(0)
+    persistence_manager.save(journal)
+    with open("journal.log") as file:
+        print("\nThe append-only log after adding and removing one entry:")
+        print(file.read(), end="")
+    print(f"Replayed entries: {AppendOnlyPersistenceManager.replay('journal.log')}")
+
+    loaded_journal = PersistenceManager.load_from_file("journal.txt")
+    loaded_journal.add_entry("I loaded my journal")
+    print(f"\nLoaded from the file: {list(loaded_journal)}")
+
+    with JournalView("journal.txt") as journal_view:
+        print(f"Entry 1 of the memory-mapped view: {journal_view[1]}")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChunkedFileHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    web_journal = Journal()
+    web_journal.load_from_web(f"http://127.0.0.1:{server.server_port}/journal.txt")
+    server.shutdown()
+    print(f"Loaded from the web: {list(web_journal)}")
+
+    with AsyncPersistenceManager("journal.log", fsync="interval") as async_manager:
+        web_journal.add_entry("I wrote this from the background")
+        async_manager.save(web_journal)
+    print(f"Replayed after the background writer closed: {AppendOnlyPersistenceManager.replay('journal.log')[-1]}")
+
+    journal_store = JournalStore()
+    first_id = journal_store.add_entry("I cried today")
+    journal_store.add_entry("I ate a bug")
+    journal_store.add_entry("I went to the zoo")
+    journal_store.remove_entry(first_id)
+    print(f"\nJournal store after removing entry {first_id}:")
+    print(journal_store)
+
+    journal_store.index = JournalIndex.build(journal_store)
+    journal_store.add_entry("I ate a banana at the zoo")
+    print(f"Entries with 'zoo': {sorted(journal_store.index.find('zoo'))}")
+    print(f"Entries with 'ate' and 'zoo': {sorted(journal_store.index.find_all('ate', 'zoo'))}")
+    print(f"Entries with 'bug' or 'banana': {sorted(journal_store.index.find_any('bug', 'banana'))}")
+    print(f"Entries with words starting with 'ba': {sorted(journal_store.index.find_prefix('ba'))}")
+
+    PersistenceManager.save_to_file(journal_store, "journal.txt")
+    indexed_journal = PersistenceManager.load_from_file("journal.txt", JournalStore())
+    print(f"Loaded index finds 'zoo' in: {sorted(indexed_journal.index.find('zoo'))}")
+
+    PersistenceManager.convert_text_to_binary("journal.txt", "journal.bin")
+    with BinaryJournalView("journal.bin") as binary_view:
+        print(f"Entry 1 of the binary journal: {binary_view[1]}")
+
+    #benchmark_persist_latency()
+    #benchmark_journal_store()
+    #benchmark_journal_index()
+    #benchmark_binary_journal()
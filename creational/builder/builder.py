@@ -17,7 +17,13 @@
 # Author: Wei-Chih Lin (weichih.lin@protonmail.com)
 ##########################################################################
 
+import collections
+import io
+import os
+import time
+import tracemalloc
 import typing
+import weakref
 
 def before_using_builder_to_construct_html():
     ## simple scenario
@@ -34,31 +40,383 @@ def before_using_builder_to_construct_html():
     print("\n".join(parts))
 
 
+## rendered fragments of unchanged subtrees, least recently used evicted first once the
+## total size passes max_chars. Each fragment lives on its element and the cache only
+## holds weak references, so dropping a document frees its fragments too. Leaves, and
+## fragments outside [min_fragment_chars, max_fragment_chars], are cheaper to render again
+## than to keep, so they are never cached. A render never evicts a fragment it has read or
+## stored itself: once those fill the cache, new fragments are turned away instead, so a
+## document bigger than the cache keeps part of itself rather than evicting all of it
+class FragmentCache:
+    ## epoch of the children whose parent fragment is cached, the first to go
+    _COVERED = -1
+
+    def __init__(self, max_chars: int = 16 * 2**20, min_fragment_chars: int = 1024,
+                 max_fragment_chars: typing.Optional[int] = None):
+        self.max_chars = max_chars
+        self.min_fragment_chars = min_fragment_chars
+        self.max_fragment_chars = max_chars // 16 if max_fragment_chars is None else max_fragment_chars
+        ## [fragment length, epoch of the last render that used it] by weak reference to the
+        ## element, least recently used first
+        self._entries: "collections.OrderedDict[weakref.ref, typing.List[int]]" = collections.OrderedDict()
+        self.epoch = 0
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+
+    ## assigning indent_size on an element invalidates it, assigning it on the class does not,
+    ## so fragments also remember the class default their descendants were rendered with
+    @staticmethod
+    def _key(element: "HtmlElement", indent: int) -> typing.Tuple[int, int, int]:
+        return indent, element.indent_size, HtmlElement.indent_size
+
+    def get(self, element: "HtmlElement", indent: int) -> typing.Optional[str]:
+        cached = element._fragment
+        if cached is None or cached[0] is not self or cached[1] != self._key(element, indent):
+            return None
+        reference = weakref.ref(element)
+        self._entries[reference][1] = self.epoch
+        self._entries.move_to_end(reference)
+        self.hits += 1
+        return cached[2]
+
+    def admits(self, size: int) -> bool:
+        if not self.min_fragment_chars <= size <= self.max_fragment_chars:
+            return False
+        if self.chars + size <= self.max_chars:
+            return True
+        ## evicting only ever goes as far as the first fragment used by this render
+        for entry in self._entries.values():
+            if entry[1] == self.epoch:
+                self.rejections += 1
+                return False
+            size -= entry[0]
+            if self.chars + size <= self.max_chars:
+                return True
+        return False
+
+    def put(self, element: "HtmlElement", indent: int, fragment: str):
+        self.discard(element)
+        ## the children are covered by this fragment until it is invalidated, so they go
+        ## first when space runs out, ahead of the fragments that are actually read
+        for child in element.elements:
+            cached = child._fragment
+            if cached is not None and cached[0] is self:
+                reference = weakref.ref(child)
+                self._entries[reference][1] = self._COVERED
+                self._entries.move_to_end(reference, last=False)
+        element._fragment = (self, self._key(element, indent), fragment)
+        self._entries[weakref.ref(element, self._forget)] = [len(fragment), self.epoch]
+        self.chars += len(fragment)
+        self.misses += 1
+        while self.chars > self.max_chars:
+            evicted, (length, _) = self._entries.popitem(last=False)
+            self.chars -= length
+            self.evictions += 1
+            evicted_element = evicted()
+            if evicted_element is not None:
+                evicted_element._fragment = None
+
+    def discard(self, element: "HtmlElement"):
+        cached = element._fragment
+        if cached is not None:
+            element._fragment = None
+            owner = cached[0]
+            entry = owner._entries.pop(weakref.ref(element), None)
+            if entry is not None:
+                owner.chars -= entry[0]
+
+    ## called when an element with a fragment is garbage collected
+    def _forget(self, reference: weakref.ref):
+        entry = self._entries.pop(reference, None)
+        if entry is not None:
+            self.chars -= entry[0]
+
+    def clear(self):
+        for reference in self._entries:
+            element = reference()
+            if element is not None:
+                element._fragment = None
+        self._entries.clear()
+        self.chars = 0
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {"fragments": len(self._entries), "chars": self.chars, "max_chars": self.max_chars,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "rejections": self.rejections}
+
+## a list of child elements that tells its owner whenever it changes, so the owner and its
+## ancestors drop their cached fragments. Every child keeps a link to its owner for each
+## time it is in the list, so an element may appear under several parents, or twice in one
+class ElementList(list):
+    def __init__(self, owner: "HtmlElement", elements: typing.Iterable["HtmlElement"] = ()):
+        super().__init__(elements)
+        self._owner = owner
+        for element in self:
+            element._parents.append(owner)
+
+    def _adopt(self, elements: typing.Iterable["HtmlElement"]):
+        for element in elements:
+            element._parents.append(self._owner)
+        self._owner._invalidate()
+
+    def _release(self, elements: typing.Iterable["HtmlElement"]):
+        for element in elements:
+            element._parents.remove(self._owner)
+        self._owner._invalidate()
+
+    def append(self, element):
+        super().append(element)
+        self._adopt((element,))
+
+    def extend(self, elements):
+        elements = list(elements)
+        super().extend(elements)
+        self._adopt(elements)
+
+    def insert(self, index, element):
+        super().insert(index, element)
+        self._adopt((element,))
+
+    def __setitem__(self, index, value):
+        replaced = self[index] if isinstance(index, slice) else [self[index]]
+        if isinstance(index, slice):
+            value = list(value)
+            super().__setitem__(index, value)
+        else:
+            super().__setitem__(index, value)
+            value = [value]
+        self._release(replaced)
+        self._adopt(value)
+
+    def __iadd__(self, elements):
+        self.extend(elements)
+        return self
+
+    def __imul__(self, count):
+        before = list(self)
+        super().__imul__(count)
+        self._release(before)
+        self._adopt(self)
+        return self
+
+    def __delitem__(self, index):
+        removed = self[index] if isinstance(index, slice) else [self[index]]
+        super().__delitem__(index)
+        self._release(removed)
+
+    def remove(self, element):
+        super().remove(element)
+        self._release((element,))
+
+    def pop(self, index=-1):
+        element = super().pop(index)
+        self._release((element,))
+        return element
+
+    def clear(self):
+        removed = list(self)
+        super().clear()
+        self._release(removed)
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._owner._invalidate()
+
+    def reverse(self):
+        super().reverse()
+        self._owner._invalidate()
+
+## copies, deep copies and pickles of an element carry its content, not its parents or fragments
+def _rebuild_element(cls: type, state: typing.Dict[str, typing.Any], elements: typing.List["HtmlElement"]) -> "HtmlElement":
+    element = cls.__new__(cls)
+    element.__dict__.update(state, _parents=[], _fragment=None)
+    element.__dict__["elements"] = ElementList(element, elements)
+    return element
+
+## assigning name, text, indent_size or elements, on an element or on the class, or changing
+## the elements list, invalidates the cached fragments of the element and every ancestor
 class HtmlElement:
     indent_size: int = 2
+    ## indentation strings by number of spaces, shared by every render; only short ones are
+    ## kept, a very deep document would otherwise leave all of its indentation behind
+    _indents: typing.Dict[int, str] = {}
+    _MAX_CACHED_INDENT = 1024
+    fragment_cache: FragmentCache = FragmentCache()
+    _RENDERED = frozenset({"name", "text", "indent_size", "elements"})
+    _INTERNAL = frozenset({"elements", "_parents", "_fragment"})
 
     def __init__(self, name: str="", text: str=""):
-        self.name: str = name
-        self.text: str = text
-        self.elements: typing.List[HtmlElement] = []
+        ## written to __dict__ directly, a new element has nothing to invalidate. _fragment is
+        ## (cache, (indent, indent sizes), fragment) while a FragmentCache keeps one, and
+        ## _parents has one entry per place the element is a child
+        self.__dict__.update(name=name, text=text, _parents=[], _fragment=None)
+        self.__dict__["elements"] = ElementList(self)
+
+    def __setattr__(self, name: str, value: typing.Any):
+        if name == "elements":
+            previous = self.__dict__["elements"]
+            previous._release(list(previous))
+            value = ElementList(self, value)
+        object.__setattr__(self, name, value)
+        if name in self._RENDERED:
+            self._invalidate()
+
+    def __reduce__(self):
+        state = {key: value for key, value in self.__dict__.items() if key not in self._INTERNAL}
+        return _rebuild_element, (type(self), state, list(self.elements))
 
-    def __str(self, indent: int):
-        lines: typing.List[str] = []
-        indent_text: str = " " * (indent * self.indent_size)
-        lines.append(f"{indent_text}<{self.name}>")
+    ## walk up through every parent: cost is the number of ancestors, whatever the size of the tree
+    def _invalidate(self):
+        pending = [self]
+        visited = {id(self)}
+        while pending:
+            element = pending.pop()
+            if element._fragment is not None:
+                element.fragment_cache.discard(element)
+            for parent in element._parents:
+                if id(parent) not in visited:
+                    visited.add(id(parent))
+                    pending.append(parent)
 
+    @classmethod
+    def _indent(cls, spaces: int) -> str:
+        indent_text = cls._indents.get(spaces)
+        if indent_text is None:
+            indent_text = " " * spaces
+            if spaces <= cls._MAX_CACHED_INDENT:
+                cls._indents[spaces] = indent_text
+        return indent_text
+
+    def _open(self, indent: int) -> str:
+        opening = f"{self._indent(indent * self.indent_size)}<{self.name}>"
         if self.text:
-            indent1_text: str = " " * ((indent + 1) * self.indent_size)
-            lines.append(f"{indent1_text}{self.text}")
+            opening += f"\n{self._indent((indent + 1) * self.indent_size)}{self.text}"
+        return opening
+
+    def _close(self, indent: int) -> str:
+        return f"\n{self._indent(indent * self.indent_size)}</{self.name}>"
+
+    ## leaves are most of a document: render them with one f-string and the indentation
+    ## worked out once per parent, for every leaf that keeps the default indent_size
+    @classmethod
+    def _leaf_renderer(cls, indent: int) -> typing.Callable[["HtmlElement"], str]:
+        indent_size = cls.indent_size
+        outer = cls._indent(indent * indent_size)
+        inner = cls._indent((indent + 1) * indent_size)
+
+        def leaf(element: "HtmlElement") -> str:
+            if element.indent_size != indent_size:
+                return f"\n{element._open(indent)}{element._close(indent)}"
+            name = element.name
+            if element.text:
+                return f"\n{outer}<{name}>\n{inner}{element.text}\n{outer}</{name}>"
+            return f"\n{outer}<{name}>\n{outer}</{name}>"
+        return leaf
+
+    def __iter_render(self, indent: int) -> typing.Iterator[str]:
+        ## an explicit stack of (element, indent, remaining children) instead of recursion,
+        ## so any depth renders and memory grows with the depth, not the number of siblings;
+        ## cached subtrees are yielded whole, streaming never fills the cache
+        cache = self.fragment_cache
+        fragment = cache.get(self, indent)
+        if fragment is not None:
+            yield fragment
+            return
+        yield self._open(indent)
+        stack = [(self, indent, iter(self.elements))]
+        while stack:
+            frame = stack.pop()
+            element, element_indent, children = frame
+            child_indent = element_indent + 1
+            leaf = self._leaf_renderer(child_indent)
+            for child in children:
+                if not child.elements:
+                    yield leaf(child)
+                    continue
+                fragment = child._fragment and cache.get(child, child_indent)
+                if fragment:
+                    yield "\n"
+                    yield fragment
+                else:
+                    yield f"\n{child._open(child_indent)}"
+                    stack.append(frame)
+                    stack.append((child, child_indent, iter(child.elements)))
+                    break
+            else:
+                yield element._close(element_indent)
+
+    ## stream the document as small chunks instead of joining every subtree into a string
+    def iter_render(self) -> typing.Iterator[str]:
+        return self.__iter_render(0)
 
-        for element in self.elements:
-            lines.append(element.__str(indent + 1))
+    ## write the document to anything with a write() method, a bounded buffer of chunks at a time
+    def render_to(self, stream: typing.TextIO, buffer_size: int = 64 * 1024):
+        buffer: typing.List[str] = []
+        buffered = 0
+        for chunk in self.iter_render():
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= buffer_size:
+                stream.write("".join(buffer))
+                buffer.clear()
+                buffered = 0
+        if buffer:
+            stream.write("".join(buffer))
 
-        lines.append(f"{indent_text}</{self.name}>")
-        return "\n".join(lines)
+    def __render(self, indent: int) -> str:
+        ## same walk as __iter_render, but every chunk lands in one list and each finished
+        ## subtree the cache admits is joined in place and kept; other subtrees stay as
+        ## chunks, so deep documents are not copied once per level
+        cache = self.fragment_cache
+        fragment = cache.get(self, indent)
+        if fragment is not None:
+            return fragment
+        cache.epoch += 1
+        chunks = [self._open(indent)]
+        append = chunks.append
+        size = len(chunks[0])
+        ## (element, indent, remaining children, first chunk, size before the element)
+        stack = [(self, indent, iter(self.elements), 0, 0)]
+        while stack:
+            frame = stack.pop()
+            element, element_indent, children, first, start = frame
+            child_indent = element_indent + 1
+            leaf = self._leaf_renderer(child_indent)
+            for child in children:
+                if not child.elements:
+                    fragment = leaf(child)
+                    append(fragment)
+                    size += len(fragment)
+                    continue
+                fragment = child._fragment and cache.get(child, child_indent)
+                if fragment:
+                    append("\n")
+                    append(fragment)
+                    size += len(fragment) + 1
+                else:
+                    append("\n")
+                    stack.append(frame)
+                    stack.append((child, child_indent, iter(child.elements), len(chunks), size + 1))
+                    fragment = child._open(child_indent)
+                    append(fragment)
+                    size += len(fragment) + 1
+                    break
+            else:
+                fragment = element._close(element_indent)
+                append(fragment)
+                size += len(fragment)
+                if element.elements and cache.admits(size - start):
+                    fragment = "".join(chunks[first:])
+                    del chunks[first:]
+                    append(fragment)
+                    cache.put(element, element_indent, fragment)
+        return "".join(chunks)
 
     def __str__(self) -> str:
-        return self.__str(0)
+        return self.__render(0)
 
     @staticmethod
     def create():
@@ -83,6 +441,12 @@ class HtmlBuilder:
     def clear(self):
         self.__root = HtmlElement(name=self.root_name)
 
+    def iter_render(self) -> typing.Iterator[str]:
+        return self.__root.iter_render()
+
+    def render_to(self, stream: typing.TextIO):
+        self.__root.render_to(stream)
+
     def __str__(self):
         return str(self.__root)
 
@@ -98,8 +462,120 @@ def using_builder_to_construct_html():
     print("\nfluent builder:")
     print(builder)
 
+def make_document(width: int, depth: int) -> HtmlElement:
+    ## every element below the root has `width` children, down to `depth` levels
+    root = HtmlElement("html")
+    level = [root]
+    for i in range(depth):
+        next_level = []
+        for parent in level:
+            for j in range(width):
+                element = HtmlElement("div", f"node {i}.{j}")
+                parent.elements.append(element)
+                next_level.append(element)
+        level = next_level
+    return root
+
+def make_deep_document(depth: int) -> HtmlElement:
+    root = element = HtmlElement("html")
+    for i in range(depth):
+        child = HtmlElement("div", f"level {i}")
+        element.elements.append(child)
+        element = child
+    return root
+
+## the original recursive renderer, one joined string per element, kept as the baseline
+def render_recursively(element: HtmlElement, indent: int = 0) -> str:
+    lines: typing.List[str] = []
+    indent_text: str = " " * (indent * element.indent_size)
+    lines.append(f"{indent_text}<{element.name}>")
+    if element.text:
+        lines.append(f"{' ' * ((indent + 1) * element.indent_size)}{element.text}")
+    for child in element.elements:
+        lines.append(render_recursively(child, indent + 1))
+    lines.append(f"{indent_text}</{element.name}>")
+    return "\n".join(lines)
+
+def benchmark_iterative_render(depth: int = 10_000, width: int = 1_000_000, cube: int = 100):
+    ## the fragment cache is disabled, so only the renderers are compared
+    default_cache = HtmlElement.fragment_cache
+    HtmlElement.fragment_cache = FragmentCache(max_chars=0)
+    for label, document in ((f"deep ({depth:,} levels)", make_deep_document(depth)),
+                            (f"wide ({width:,} siblings)", make_document(width, 1)),
+                            (f"{cube}^3", make_document(cube, 3))):
+        timings = []
+        for render in (render_recursively, str):
+            start = time.perf_counter()
+            try:
+                text = render(document)
+            except RecursionError:
+                timings.append("RecursionError")
+                continue
+            timings.append(f"{time.perf_counter() - start:8.3f}s")
+        print(f"{label:<26} recursive {timings[0]:>14}, iterative {timings[1]:>14}, {len(text) / 2**20:8.2f} MiB of html")
+    HtmlElement.fragment_cache = default_cache
+
+def benchmark_streaming_render(width: int = 1_000, depth: int = 2):
+    document = make_document(width, depth)
+    with open(os.devnull, "w") as sink:
+        for label, render in (("str()", lambda: sink.write(str(document))),
+                              ("render_to()", lambda: document.render_to(sink))):
+            tracemalloc.start()
+            start = time.perf_counter()
+            render()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{label:<12} {elapsed:8.3f}s, peak memory {peak / 2**20:8.2f} MiB")
+
+def benchmark_incremental_render(shapes: typing.Iterable[typing.Tuple[int, int]] = ((10, 5), (100, 3)), edits: int = 20):
+    ## a disabled cache (max_chars=0) is the baseline; 10^5 fits in the default cache, 100^3 does not
+    default_cache = HtmlElement.fragment_cache
+    for width, depth in shapes:
+        document = make_document(width, depth)
+        leaves = [document]
+        while leaves[0].elements:
+            leaves = [child for element in leaves for child in element.elements]
+        print(f"{len(leaves):,} leaves ({width}^{depth}):")
+        for label, cache in (("no cache", FragmentCache(max_chars=0)), ("fragment cache", default_cache)):
+            HtmlElement.fragment_cache = cache
+            cache.clear()
+            start = time.perf_counter()
+            str(document)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(edits):
+                str(document)
+            unchanged = (time.perf_counter() - start) / edits
+            start = time.perf_counter()
+            for i in range(edits):
+                leaves[i * 7919 % len(leaves)].text = f"edit {i}"
+                str(document)
+            edited = (time.perf_counter() - start) / edits
+            print(f"  {label:<16} first {cold * 1e3:9.2f}ms, unchanged {unchanged * 1e3:9.2f}ms, "
+                  f"after an edit {edited * 1e3:9.2f}ms")
+        print(f"  cache: {default_cache.stats()}")
+        default_cache.clear()
+    HtmlElement.fragment_cache = default_cache
 
 if __name__ == "__main__":
     #before_using_builder_to_construct_html()
     using_builder_to_construct_html()
 
+    print("\nstreaming builder:")
+    builder = HtmlBuilder("ul")
+    builder.add_child_fluent("li", "hello").add_child_fluent("li", "world")
+    stream = io.StringIO()
+    builder.render_to(stream)
+    print(stream.getvalue())
+
+    print("\ncached fragments of a page after an edit:")
+    page = make_document(5, 4)
+    str(page)
+    page.elements[1].elements[2].text = "edited"
+    print(f"{len(str(page)):,} characters, {HtmlElement.fragment_cache.stats()}")
+
+    #benchmark_streaming_render()
+    #benchmark_iterative_render()
+    #benchmark_incremental_render()
+